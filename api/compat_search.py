@@ -6,23 +6,41 @@ Compat API for ToolTally — with /categories (deduped) and category filtering.
 - /categories: list distinct categories with counts (normalized to avoid dupes)
 - /products: search + pagination (+ optional ?category=), lowest_price ignores 0/NULL and rows without URL
 - /product/<pid>: detail + offers (best row per vendor), TEXT-safe ids
+- /health: liveness probe
 
 Run:
-  pip install flask flask-cors
+  pip install flask flask-cors orjson waitress   (orjson/waitress are optional)
   py api\\compat_search.py
 """
 
 from __future__ import annotations
+import os
+import queue
 import re
 import sqlite3
-from typing import Any, Dict, List, Optional, Tuple
-from flask import Flask, jsonify, request, abort
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from flask import Flask, request, abort
+from werkzeug.datastructures import MultiDict
 
 try:
     from flask_cors import CORS
 except ImportError:
     CORS = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
+
 DB_PATH = "data/tooltally.db"
 
 app = Flask(__name__)
@@ -35,149 +53,439 @@ if CORS:
     })
 
 # ---------------- DB ----------------
+# Read-side tuning only: connections are read-only, so journal_mode and
+# synchronous (which write) can't be set here. scripts/migrate.py puts the DB
+# in WAL, which persists and lets these readers run alongside the writers.
+DB_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+)
+
 def open_db() -> sqlite3.Connection:
-    con = sqlite3.connect(DB_PATH)
+    # The compat endpoints never write, so open read-only. Every statement is
+    # fully parameterised and its text fixed per query shape (search_sql,
+    # page_sql), so a larger per-connection statement cache keeps them all
+    # prepared across requests.
+    con = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False,
+                          cached_statements=256)
     con.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        con.execute(pragma)
     return con
 
+class ConnectionPool:
+    """Bounded pool of read-only connections, reused across requests so each
+    hit skips the open/pragma setup and keeps SQLite's page cache warm."""
+
+    def __init__(self, size: int):
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+
+    def fill(self) -> None:
+        """Open connections up to the pool size, so early requests don't pay for it."""
+        while not self._idle.full():
+            con = open_db()
+            try:
+                self._idle.put_nowait(con)
+            except queue.Full:
+                con.close()
+
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        try:
+            con = self._idle.get_nowait()
+        except queue.Empty:
+            con = open_db()
+        try:
+            yield con
+        finally:
+            try:
+                self._idle.put_nowait(con)
+            except queue.Full:
+                con.close()
+
+# One connection per server thread, so concurrent readers never queue for one.
+SERVER_THREADS = os.cpu_count() or 4
+POOL = ConnectionPool(size=SERVER_THREADS)
+
+# ---------------- responses ----------------
+def _dumps(payload: Any) -> bytes:
+    # orjson when available: several times faster than Flask's json on list pages.
+    if orjson is None:
+        return app.json.dumps(payload).encode("utf-8")
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+def _json_body(body: bytes):
+    return app.response_class(body, mimetype="application/json")
+
+def _json(payload: Any):
+    return _json_body(_dumps(payload))
+
+# ---------------- response cache ----------------
+def db_version() -> Tuple[int, int]:
+    """Changes on every committed write. With WAL, commits land in the -wal
+    file and only reach the main file at checkpoint, so stat both."""
+    version = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            version.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            version.append(0)
+    return version[0], version[1]
+
+def db_etag() -> str:
+    main, wal = db_version()
+    return f"{main:x}-{wal:x}"
+
+# The cached list endpoints: their responses are derived from the DB alone,
+# so the DB version is their ETag. /health must always run, and /product/<id>
+# must still 404 for unknown ids, so those never short-circuit.
+ETAG_ENDPOINTS = {"categories", "products", "search"}
+
+@app.before_request
+def not_modified():
+    # A matching ETag means the client's copy is current and SQLite needn't
+    # be touched.
+    if (request.method == "GET" and request.endpoint in ETAG_ENDPOINTS
+            and request.if_none_match.contains(db_etag())):
+        resp = app.response_class(status=304)
+        resp.set_etag(db_etag())
+        return resp
+    return None
+
+# Seconds browsers/proxies may reuse a response without revalidating; data
+# only changes on scraper runs. Everything else always revalidates.
+CACHE_MAX_AGE = {"categories": 60, "products": 10}
+
+@app.after_request
+def stamp_etag(resp):
+    if request.method == "GET" and resp.status_code == 200:
+        if request.endpoint in ETAG_ENDPOINTS:
+            resp.set_etag(db_etag())
+        max_age = CACHE_MAX_AGE.get(request.endpoint)
+        if max_age:
+            resp.cache_control.public = True
+            resp.cache_control.max_age = max_age
+        else:
+            resp.cache_control.no_cache = True
+    return resp
+
 # ---------------- helpers ----------------
 ALNUM_UPPER = re.compile(r'[^A-Z0-9]+')
 MODEL_CODE  = re.compile(r'\b([A-Z]{2,5}\d{2,4}[A-Z0-9-]*)\b', re.I)
+TOKEN_SPLIT = re.compile(r'\s+')
+# One pass for all query rewrites: 20V MAX -> 18v, 10.8V -> 12v, drop a
+# leading "20" glued to a model code (e.g. 20DCD796).
+NORMALIZE_RE = re.compile(r'(20\s*v\s*max)|(10\.8\s*v)|(\b20(?=[A-Za-z]{2,}\d))', re.I)
+MODEL_SUFFIX = re.compile(r'(Z|N|NT|J|TJ|RTJ|RJ|RFJ|RMJ|PS|P1|P2)$')
+SLUG_NONALNUM = re.compile(r'[^a-z0-9]+')
+SLUG_DASHES   = re.compile(r'-{2,}')
 
 def norm_alnum_upper(s: str) -> str:
     return ALNUM_UPPER.sub('', (s or '').upper())
 
-def normalize_query(q: str) -> str:
-    t = q or ""
-    t = re.sub(r'20\s*v\s*max', '18v', t, flags=re.I)
-    t = re.sub(r'10\.8\s*v', '12v', t, flags=re.I)
-    t = re.sub(r'\b20(?=[A-Za-z]{2,}\d)', '', t)
-    return t.strip()
+def _norm_sub(m: re.Match) -> str:
+    return "18v" if m.group(1) else "12v" if m.group(2) else ""
 
+# Query strings repeat heavily, so the parsing helpers are memoised.
+@lru_cache(maxsize=4096)
+def normalize_query(q: str) -> str:
+    return NORMALIZE_RE.sub(_norm_sub, q or "").strip()
+
+@lru_cache(maxsize=4096)
+def search_key(q: str) -> str:
+    """Canonical search string, so "Makita  DHP484 " and "makita dhp484"
+    share one cached /products page. Token matching (trigram FTS, LIKE) is
+    ASCII case-insensitive and splits on whitespace; LIKE doesn't fold
+    non-ASCII case, so only pure-ASCII queries are lower-cased."""
+    q = " ".join(normalize_query(q).split())
+    return q.lower() if q.isascii() else q
+
+@lru_cache(maxsize=4096)
 def extract_model_from_query(q: str) -> Optional[str]:
     m = MODEL_CODE.search(q or '')
     if not m:
         return None
     code = m.group(1).upper().replace(' ', '')
-    base = re.sub(r'(Z|N|NT|J|TJ|RTJ|RJ|RFJ|RMJ|PS|P1|P2)$', '', code)
+    base = MODEL_SUFFIX.sub('', code)
     return base
 
-def build_search_parts(q_raw: str) -> Tuple[str, List[Any], Optional[str], Optional[int], Tuple[str, List[Any]]]:
-    q = normalize_query(q_raw)
-    params: List[Any] = []
+# Brands come from a small fixed set, so title-case each one once.
+@lru_cache(maxsize=1024)
+def brand_title(brand: str) -> str:
+    return brand.title()
+
+@lru_cache(maxsize=1024)
+def slugify(s: str) -> str:
+    s = s.strip().lower()
+    s = SLUG_NONALNUM.sub('-', s)
+    s = SLUG_DASHES.sub('-', s).strip('-')
+    return s or 'uncategorized'
+
+# Token matching goes through products_fts (trigram, see scripts/migrate.py);
+# shorter tokens can't produce a trigram and stay on LIKE.
+FTS_MIN_TOKEN = 3
+
+def fts_phrase(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+def model_match(model: str) -> str:
+    # Substring match on model or name; model codes are always 4+ chars, so
+    # the trigram index can serve them.
+    return f"{{model name}} : {fts_phrase(model)}"
+
+FTS_TERM  = "p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+# Short tokens (no FTS) match name/brand/model with one LIKE over the joined
+# columns. Tokens never contain whitespace, so a hit can't straddle the
+# separator, and it's one bound value and one C-level scan per token.
+LIKE_TERM = "(COALESCE(p.name,'') || ' ' || COALESCE(p.brand,'') || ' ' || COALESCE(p.model,'')) LIKE ?"
+# name_norm/model_norm are generated columns (scripts/migrate.py) with a
+# trigram index, products_norm_fts. Normalised strings of 3+ chars probe that;
+# shorter ones scan the plain column indexes, which at least reads the stored
+# values instead of recomputing UPPER/REPLACE for every row.
+NORM_FTS_CLAUSE = "p.id IN (SELECT rowid FROM products_norm_fts WHERE products_norm_fts MATCH ?)"
+NORM_CLAUSE = (
+    "(p.id IN (SELECT id FROM products INDEXED BY products_name_norm WHERE name_norm LIKE ?)"
+    " OR p.id IN (SELECT id FROM products INDEXED BY products_model_norm WHERE model_norm LIKE ?))"
+)
+
+@lru_cache(maxsize=32)
+def search_sql(has_model: bool, norm_is_fts: bool, fts_flags: Tuple[bool, ...]) -> Tuple[str, str]:
+    """(primary WHERE, fallback WHERE) for one query shape: whether a model
+    code was found, and which terms go through FTS vs LIKE. Only the bound
+    params differ between queries of the same shape."""
     clauses: List[str] = []
+    if has_model:
+        clauses.append(FTS_TERM)
+    clauses.append(NORM_FTS_CLAUSE if norm_is_fts else NORM_CLAUSE)
+    primary_where = "WHERE (" + " OR ".join(clauses) + ")"
+
+    # Keep products matching at least half of the tokens. Each product is one
+    # row here, so this is a plain row filter rather than a GROUP BY/HAVING.
+    if fts_flags:
+        score_expr = " + ".join(
+            f"CASE WHEN {FTS_TERM if is_fts else LIKE_TERM} THEN 1 ELSE 0 END" for is_fts in fts_flags
+        )
+        primary_where += f" AND ({score_expr}) >= ?"
 
-    model = extract_model_from_query(q)
-    if model:
-        like_model = f"%{model}%"
-        clauses.append("(p.model LIKE ? OR p.name LIKE ?)")
-        params.extend([like_model, like_model])
+    or_pieces: List[str] = []
+    if any(fts_flags):
+        or_pieces.append(FTS_TERM)
+    or_pieces.extend(LIKE_TERM for is_fts in fts_flags if not is_fts)
+    fallback_where = "WHERE " + (" OR ".join(or_pieces) if or_pieces else "1=1")
 
+    return primary_where, fallback_where
+
+def build_search_parts(q_raw: str) -> Tuple[str, List[Any], Tuple[str, List[Any]]]:
+    q = normalize_query(q_raw)
+    tokens = [t for t in TOKEN_SPLIT.split(q) if t]
+    model = extract_model_from_query(q)
+    fts_flags = tuple(len(t) >= FTS_MIN_TOKEN for t in tokens)
     q_norm = norm_alnum_upper(q)
-    norm_clause = "(REPLACE(REPLACE(UPPER(p.name),' ','') ,'-','') LIKE ? OR REPLACE(REPLACE(UPPER(COALESCE(p.model,'')),' ','') ,'-','') LIKE ?)"
-    params.extend([f"%{q_norm}%", f"%{q_norm}%"])
-    clauses.append(norm_clause)
-
-    tokens = [t for t in re.split(r'\s+', q) if t]
-    token_score_terms = []
-    for t in tokens:
-        t_like_escaped = t.replace("'", "''")
-        token_score_terms.append(
-            f"(p.name LIKE '%{t_like_escaped}%' OR p.brand LIKE '%{t_like_escaped}%' OR p.model LIKE '%{t_like_escaped}%')"
-        )
-    score_expr = None
-    score_threshold = None
-    if token_score_terms:
-        score_expr = " + ".join(f"CASE WHEN {s} THEN 1 ELSE 0 END" for s in token_score_terms)
-        score_threshold = max(1, (len(tokens) + 1) // 2)
+    norm_is_fts = len(q_norm) >= FTS_MIN_TOKEN
+    primary_where, fallback_where = search_sql(bool(model), norm_is_fts, fts_flags)
 
-    primary_where = "WHERE " + " OR ".join(clauses) if clauses else ""
+    params: List[Any] = []
+    if model:
+        params.append(model_match(model))
+    if norm_is_fts:
+        params.append(fts_phrase(q_norm))
+    else:
+        params.extend([f"%{q_norm}%"] * 2)
+
+    for t, is_fts in zip(tokens, fts_flags):
+        if is_fts:
+            params.append(f"{{name brand model}} : {fts_phrase(t)}")
+        else:
+            params.append(f"%{t}%")
+    if tokens:
+        params.append(max(1, (len(tokens) + 1) // 2))
 
     fb_params: List[Any] = []
-    or_pieces: List[str] = []
-    for t in tokens:
-        like = f"%{t}%"
-        or_pieces.append("(p.name LIKE ? OR p.brand LIKE ? OR p.model LIKE ?)")
-        fb_params.extend([like, like, like])
-    fallback_where = "WHERE " + (" OR ".join(or_pieces) if or_pieces else "1=1")
+    fts_tokens = [t for t, is_fts in zip(tokens, fts_flags) if is_fts]
+    if fts_tokens:
+        fb_params.append("{name brand model} : (" + " OR ".join(fts_phrase(t) for t in fts_tokens) + ")")
+    for t, is_fts in zip(tokens, fts_flags):
+        if not is_fts:
+            fb_params.append(f"%{t}%")
 
-    return primary_where, params, score_expr, score_threshold, (fallback_where, fb_params)
+    return primary_where, params, (fallback_where, fb_params)
 
 # ---------------- offers helper ----------------
-def get_offers(cur: sqlite3.Cursor, product_id_text: str) -> List[Dict[str, Any]]:
-    cur.execute("""
-        WITH ranked AS (
-          SELECT
-            o.vendor_id,
-            v.name AS vendor_name,
-            o.price_pounds AS price,
-            o.url AS vendor_product_url,
-            ROW_NUMBER() OVER (
-              PARTITION BY o.vendor_id
-              ORDER BY
-                CASE WHEN (o.url IS NULL OR o.url='') THEN 1 ELSE 0 END ASC,
-                CASE WHEN (o.price_pounds IS NULL OR o.price_pounds=0) THEN 1 ELSE 0 END ASC,
-                o.price_pounds ASC,
-                o.id ASC
-            ) AS rn
-          FROM offers o
-          JOIN vendors v ON v.id = o.vendor_id
-          WHERE CAST(o.product_id AS TEXT) = ?
-        )
-        SELECT vendor_name, price, vendor_product_url
-        FROM ranked
-        WHERE rn = 1
+# Correlated on p.id, so the product row and its offers come back in one
+# query. Best offer per vendor: for each vendor of the product, a LIMIT 1
+# probe of the (product_id, vendor_id, has-url, has-price, price, id) index
+# picks the row, so no partition has to be sorted. The ordered inner select
+# feeds json_group_array in order; it only runs for the row actually returned.
+OFFERS_JSON = """(
+    SELECT json_group_array(json_object(
+      'vendor_name', b.vendor_name,
+      'price', b.price,
+      'original_price', NULL,
+      'availability', 'unknown',
+      'vendor_product_url', b.vendor_product_url,
+      'delivery_info', NULL
+    ))
+    FROM (
+      SELECT
+        v.name AS vendor_name,
+        CAST(o.price_pounds AS REAL) AS price,
+        o.url AS vendor_product_url
+      FROM (SELECT DISTINCT vendor_id FROM offers WHERE product_id = p.id) pv
+      JOIN offers o ON o.id = (
+        SELECT o2.id
+        FROM offers o2
+        WHERE o2.product_id = p.id AND o2.vendor_id = pv.vendor_id
         ORDER BY
-          CASE WHEN (price IS NULL OR price=0) THEN 1 ELSE 0 END ASC,
-          price ASC
-    """, (str(product_id_text),))
-    out: List[Dict[str, Any]] = []
-    for r in cur.fetchall():
-        price = float(r["price"]) if r["price"] is not None else None
-        out.append({
-            "vendor_name": r["vendor_name"],
-            "price": price,
-            "original_price": None,
-            "availability": "unknown",
-            "vendor_product_url": r["vendor_product_url"],
-            "delivery_info": None,
-        })
-    return out
+          (o2.url IS NULL OR o2.url='') ASC,
+          (o2.price_pounds IS NULL OR o2.price_pounds=0) ASC,
+          o2.price_pounds ASC,
+          o2.id ASC
+        LIMIT 1
+      )
+      JOIN vendors v ON v.id = o.vendor_id
+      ORDER BY
+        (o.price_pounds IS NULL OR o.price_pounds=0) ASC,
+        o.price_pounds ASC
+    ) b
+  ) AS offers_json"""
+
+def _loads(text: str) -> Any:
+    return orjson.loads(text) if orjson is not None else app.json.loads(text)
+
+def product_payload(p: sqlite3.Row) -> Dict[str, Any]:
+    """/product and /search body for a row selected with OFFERS_JSON."""
+    return {
+        "product_info": {
+            "id": str(p["id"]),
+            "title": p["name"] or "",
+            "brand": brand_title(p["brand"]) if p["brand"] else "",
+            "description": "",
+            "image_url": p["image_url"],  # << return actual image for detail too
+        },
+        "offers": _loads(p["offers_json"]),
+    }
+
+# ---------------- list helper ----------------
+PAGE_COLUMNS = """
+          CAST(p.id AS TEXT) AS id,
+          p.name AS title,
+          p.brand,
+          p.image_url AS image_url,  -- << return real image
+          CAST(s.lowest_price AS REAL) AS lowest_price,  -- NULL stays NULL
+          COALESCE(s.url_vendor_count, 0) AS vendor_count"""
+
+def page_item(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "brand": brand_title(row["brand"]) if row["brand"] else None,
+        "image_url": row["image_url"],  # << use it
+        "lowest_price": row["lowest_price"],
+        "vendor_count": row["vendor_count"],
+    }
+
+def fetch_page(cur: sqlite3.Cursor, where: str, params: List[Any],
+               limit: int, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+    """One page of /products items plus the total match count, in a single query."""
+    list_sql, count_sql = page_sql(where)
+    cur.execute(list_sql, params + [limit, offset])
+    items: List[Dict[str, Any]] = []
+    total = 0
+    for row in cur:
+        total = row["total"]
+        items.append(page_item(row))
+    if items or offset == 0:
+        return items, total
+    # Paged past the end: the window total isn't available, count separately.
+    return items, cur.execute(count_sql, params).fetchone()[0]
+
+@lru_cache(maxsize=64)
+def page_sql(where: str) -> Tuple[str, str]:
+    """(page query, count query) for a WHERE clause; built once per shape.
+
+    offer_stats holds one row per product, so the join never fans out and
+    needs no GROUP BY: SQLite filters rows straight into the ORDER BY/LIMIT
+    sorter instead of materialising every matching product first."""
+    list_sql = f"""
+        SELECT {PAGE_COLUMNS},
+          COUNT(*) OVER () AS total
+        FROM products p
+        LEFT JOIN offer_stats s ON s.product_id = p.id
+        {where}
+        ORDER BY vendor_count DESC, lowest_price ASC, p.id ASC
+        LIMIT ? OFFSET ?
+    """
+    count_sql = f"SELECT COUNT(*) FROM products p {where}"
+    return list_sql, count_sql
+
+# Unfiltered listing (the landing page). The ranking is already materialised
+# in offer_stats, so rather than sort every product, walk it in two ordered
+# runs: products with URL offers via the offer_stats_rank index (scripts/
+# migrate.py), then the rest - vendor_count 0, lowest_price NULL - by id.
+RANKED_SQL = f"""
+    SELECT {PAGE_COLUMNS}
+    FROM offer_stats s
+    JOIN products p ON p.id = s.product_id
+    WHERE s.url_vendor_count > 0
+    ORDER BY s.url_vendor_count DESC, s.lowest_price ASC, s.product_id ASC
+    LIMIT ? OFFSET ?
+"""
+UNRANKED_SQL = f"""
+    SELECT {PAGE_COLUMNS}
+    FROM products p
+    LEFT JOIN offer_stats s ON s.product_id = p.id
+    WHERE COALESCE(s.url_vendor_count, 0) = 0
+    ORDER BY p.id ASC
+    LIMIT ? OFFSET ?
+"""
+
+def fetch_default_page(cur: sqlite3.Cursor, limit: int, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Same rows and order as fetch_page(cur, "", [], ...), reading only
+    offset + limit rows instead of sorting the whole catalogue."""
+    # Counted through the same join as RANKED_SQL, so a stats row whose
+    # product is gone can't shift the offsets.
+    ranked = cur.execute("""
+        SELECT COUNT(*) FROM offer_stats s JOIN products p ON p.id = s.product_id
+        WHERE s.url_vendor_count > 0
+    """).fetchone()[0]
+    items: List[Dict[str, Any]] = []
+    if offset < ranked:
+        items.extend(page_item(row) for row in cur.execute(RANKED_SQL, (limit, offset)))
+    if len(items) < limit:
+        cur.execute(UNRANKED_SQL, (limit - len(items), max(offset - ranked, 0)))
+        items.extend(page_item(row) for row in cur)
+    return items, cur.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+# ---------------- health ----------------
+@app.get("/health")
+def health():
+    return _json({"ok": True})
 
 # ---------------- CATEGORIES (deduped) ----------------
 @app.get("/categories")
 def categories():
-    con = open_db()
-    try:
+    return _json_body(_cached_categories(db_version()))
+
+# The page caches hold serialised bodies, so a cache hit skips the JSON
+# encoding as well as the query.
+@lru_cache(maxsize=1)
+def _cached_categories(db_mtime: Tuple[int, int]) -> bytes:
+    with POOL.acquire() as con:
         cur = con.cursor()
-        rows = cur.execute("""
-            WITH norm AS (
-              SELECT
-                CASE
-                  WHEN TRIM(COALESCE(category,'')) = '' THEN 'Uncategorized'
-                  ELSE TRIM(category)
-                END AS name_trim
-              FROM products
-            ),
-            pretty AS (
-              SELECT
-                UPPER(SUBSTR(name_trim,1,1)) || LOWER(SUBSTR(name_trim,2)) AS name
-              FROM norm
-            )
-            SELECT name, COUNT(*) AS count
-            FROM pretty
-            GROUP BY name
-            ORDER BY name ASC
-        """).fetchall()
-
-        def slugify(s: str) -> str:
-            s = s.strip().lower()
-            s = re.sub(r'[^a-z0-9]+', '-', s)
-            s = re.sub(r'-{2,}', '-', s).strip('-')
-            return s or 'uncategorized'
+        # category_pretty is an indexed generated column (scripts/migrate.py),
+        # so this is a single ordered index scan. Names that still collide
+        # on slug ("Power Tools" / "Power-tools") are merged below.
+        cur.execute("""
+            SELECT category_pretty AS name, COUNT(*) AS count
+            FROM products
+            GROUP BY category_pretty
+            ORDER BY category_pretty ASC
+        """)
 
         by_slug: Dict[str, Dict[str, Any]] = {}
-        for r in rows:
+        for r in cur:
             name = r["name"]
             count = int(r["count"] or 0)
             slug = slugify(name)
@@ -187,50 +495,53 @@ def categories():
                 by_slug[slug] = {"name": name, "slug": slug, "count": count}
 
         items = sorted(by_slug.values(), key=lambda x: x["name"])
-        return jsonify({"items": items})
-    finally:
-        con.close()
+        return _dumps({"items": items})
 
 # ---------------- list endpoint (with optional category) ----------------
+@dataclass(frozen=True, slots=True)
+class ListQuery:
+    """Parsed /products arguments; hashable, so it doubles as the page-cache key."""
+    search: str
+    category: str
+    page: int
+    limit: int
+
+def parse_list_query(args: MultiDict) -> ListQuery:
+    # type=int falls back to the default on junk input instead of raising
+    return ListQuery(
+        search=search_key(args.get("search") or ""),
+        category=(args.get("category") or "").strip(),
+        page=max(args.get("page", 1, type=int), 1),
+        limit=min(max(args.get("limit", 24, type=int), 1), 100),
+    )
+
 @app.get("/products")
 def products():
-    q_raw = (request.args.get("search") or "").strip()
-    category_raw = (request.args.get("category") or "").strip()
-    page  = max(int(request.args.get("page") or 1), 1)
-    limit = max(min(int(request.args.get("limit") or 24), 100), 1)
-    offset = (page - 1) * limit
+    return _json_body(_cached_products_page(db_version(), parse_list_query(request.args)))
 
-    con = open_db()
-    try:
+@lru_cache(maxsize=256)
+def _cached_products_page(db_mtime: Tuple[int, int], query: ListQuery) -> bytes:
+    offset = (query.page - 1) * query.limit
+
+    with POOL.acquire() as con:
         cur = con.cursor()
 
         where_sql = ""
         where_params: List[Any] = []
-        use_score_expr = None
-        use_threshold = None
 
-        if category_raw:
-            where_sql += ("WHERE " if not where_sql else " AND ") + """
-              CASE
-                WHEN TRIM(COALESCE(p.category,''))='' THEN 'Uncategorized'
-                ELSE UPPER(SUBSTR(TRIM(p.category),1,1)) || LOWER(SUBSTR(TRIM(p.category),2))
-              END = ?
-            """
-            where_params.append(category_raw.strip())
+        if query.category:
+            where_sql += ("WHERE " if not where_sql else " AND ") + "p.category_pretty = ?"
+            where_params.append(query.category)
 
-        if q_raw:
-            primary_where, primary_params, score_expr, score_threshold, fallback = build_search_parts(q_raw)
+        if query.search:
+            primary_where, primary_params, fallback = build_search_parts(query.search)
 
             if where_sql:
                 primary_where = primary_where.replace("WHERE ", "", 1)
                 primary_where = "WHERE " + where_sql.replace("WHERE ", "") + " AND (" + primary_where + ")"
                 primary_params = where_params + primary_params
 
-            cur.execute(f"SELECT COUNT(*) FROM products p {primary_where}", primary_params)
-            total = int(cur.fetchone()[0])
-
-            use_where, use_params = primary_where, primary_params
-            use_score_expr, use_threshold = score_expr, score_threshold
+            items, total = fetch_page(cur, primary_where, primary_params, query.limit, offset)
 
             if total == 0 and fallback:
                 fb_where, fb_params = fallback
@@ -238,146 +549,108 @@ def products():
                     fb_where = fb_where.replace("WHERE ", "", 1)
                     fb_where = "WHERE " + where_sql.replace("WHERE ", "") + " AND (" + fb_where + ")"
                     fb_params = where_params + fb_params
-                cur.execute(f"SELECT COUNT(*) FROM products p {fb_where}", fb_params)
-                total = int(cur.fetchone()[0])
-                use_where, use_params = fb_where, fb_params
-                use_score_expr, use_threshold = None, None
+                items, total = fetch_page(cur, fb_where, fb_params, query.limit, offset)
+        elif where_sql:
+            items, total = fetch_page(cur, where_sql, where_params, query.limit, offset)
         else:
-            if where_sql:
-                cur.execute(f"SELECT COUNT(*) FROM products p {where_sql}", where_params)
-                total = int(cur.fetchone()[0])
-                use_where, use_params = where_sql, where_params
-            else:
-                total = cur.execute("SELECT COUNT(*) FROM products").fetchone()[0]
-                use_where, use_params = "", []
-            use_score_expr, use_threshold = None, None
-
-        having_clause = f"HAVING ({use_score_expr}) >= {use_threshold}" if (use_score_expr and use_threshold is not None) else ""
-        list_sql = f"""
-            WITH o1 AS (
-              SELECT
-                CAST(o.product_id AS TEXT) AS pid,
-                o.vendor_id,
-                o.price_pounds,
-                o.url,
-                ROW_NUMBER() OVER (
-                  PARTITION BY CAST(o.product_id AS TEXT), o.vendor_id
-                  ORDER BY
-                    CASE WHEN (o.url IS NULL OR o.url='') THEN 1 ELSE 0 END ASC,
-                    CASE WHEN (o.price_pounds IS NULL OR o.price_pounds=0) THEN 1 ELSE 0 END ASC,
-                    o.price_pounds ASC,
-                    o.id ASC
-                ) AS rn
-              FROM offers o
-            )
-            SELECT
-              CAST(p.id AS TEXT) AS id,
-              p.name AS title,
-              p.brand,
-              p.image_url AS image_url,  -- << return real image
-              COALESCE(MIN(NULLIF(CASE WHEN (o1.url IS NULL OR o1.url='') THEN NULL ELSE o1.price_pounds END,0)), NULL) AS lowest_price,
-              COUNT(DISTINCT CASE WHEN (o1.url IS NOT NULL AND o1.url<>'') THEN o1.vendor_id END) AS vendor_count
-            FROM products p
-            LEFT JOIN o1 ON (o1.pid = CAST(p.id AS TEXT) AND o1.rn = 1)
-            {use_where}
-            GROUP BY p.id
-            {having_clause}
-            ORDER BY vendor_count DESC, lowest_price ASC, p.id ASC
-            LIMIT ? OFFSET ?
-        """
-        cur.execute(list_sql, use_params + [limit, offset])
-
-        items: List[Dict[str, Any]] = []
-        for row in cur.fetchall():
-            items.append({
-                "id": row["id"],
-                "title": row["title"],
-                "brand": (row["brand"] or "").title() if row["brand"] else None,
-                "image_url": row["image_url"],  # << use it
-                "lowest_price": float(row["lowest_price"]) if row["lowest_price"] is not None else None,
-                "vendor_count": int(row["vendor_count"] or 0),
-            })
-
-        return jsonify({"items": items, "total": int(total), "page": page, "limit": limit})
-    finally:
-        con.close()
+            items, total = fetch_default_page(cur, query.limit, offset)
+
+        return _dumps({"items": items, "total": total, "page": query.page, "limit": query.limit})
 
 # ---------------- product detail endpoint ----------------
 @app.get("/product/<pid>")
 def product_detail(pid: str):
-    con = open_db()
-    try:
+    with POOL.acquire() as con:
         cur = con.cursor()
-        cur.execute("SELECT * FROM products WHERE CAST(id AS TEXT) = ?", (str(pid),))
+        cur.execute(f"SELECT p.*, {OFFERS_JSON} FROM products p WHERE CAST(p.id AS TEXT) = ?", (str(pid),))
         p = cur.fetchone()
         if not p:
             abort(404)
-        offers = get_offers(cur, str(pid))
-        return jsonify({
-            "product_info": {
-                "id": str(p["id"]),
-                "title": p["name"] or "",
-                "brand": (p["brand"] or "").title() if p["brand"] else "",
-                "description": "",
-                "image_url": p["image_url"],  # << return actual image for detail too
-            },
-            "offers": offers,
-        })
-    finally:
-        con.close()
+        return _json(product_payload(p))
 
 # ---------------- single-product convenience ----------------
 @app.get("/search")
 def search():
     q_raw = (request.args.get("query") or "").strip()
     if not q_raw:
-        return jsonify({"product_info": {}, "offers": []})
+        return _json({"product_info": {}, "offers": []})
 
     q = normalize_query(q_raw)
-    con = open_db()
-    try:
+    with POOL.acquire() as con:
         cur = con.cursor()
         model = extract_model_from_query(q)
         if model:
-            like = f"%{model}%"
-            cur.execute("""
-                SELECT * FROM products p
-                WHERE p.model LIKE ? OR p.name LIKE ?
+            cur.execute(f"""
+                SELECT p.*, {OFFERS_JSON} FROM products p
+                WHERE {FTS_TERM}
                 ORDER BY p.id ASC
                 LIMIT 1
-            """, (like, like))
+            """, (model_match(model),))
             p = cur.fetchone()
         else:
-            primary_where, primary_params, score_expr, score_threshold, fallback = build_search_parts(q)
-            select_sql = f"SELECT * FROM products p {primary_where}"
-            if score_expr and score_threshold is not None:
-                select_sql += f" GROUP BY p.id HAVING ({score_expr}) >= {score_threshold}"
-            select_sql += " ORDER BY p.id ASC LIMIT 1"
-            cur.execute(select_sql, primary_params)
+            primary_where, primary_params, fallback = build_search_parts(q)
+            cur.execute(f"SELECT p.*, {OFFERS_JSON} FROM products p {primary_where} ORDER BY p.id ASC LIMIT 1", primary_params)
             p = cur.fetchone()
             if not p and fallback:
                 fb_where, fb_params = fallback
-                cur.execute(f"SELECT * FROM products p {fb_where} ORDER BY p.id ASC LIMIT 1", fb_params)
+                cur.execute(f"SELECT p.*, {OFFERS_JSON} FROM products p {fb_where} ORDER BY p.id ASC LIMIT 1", fb_params)
                 p = cur.fetchone()
 
         if not p:
-            return jsonify({"product_info": {}, "offers": []})
-
-        pid_text = str(p["id"])
-        offers = get_offers(cur, pid_text)
-        return jsonify({
-            "product_info": {
-                "id": pid_text,
-                "title": p["name"] or "",
-                "brand": (p["brand"] or "").title() if p["brand"] else "",
-                "description": "",
-                "image_url": p["image_url"],  # << include here as well
-            },
-            "offers": offers,
-        })
-    finally:
-        con.close()
+            return _json({"product_info": {}, "offers": []})
+        return _json(product_payload(p))
+
+# ---------------- startup ----------------
+# Schema the endpoints read that only the migrations create. offer_stats,
+# products.category_pretty and the FTS tables come from scripts/migrate.py,
+# which only builds the FTS tables once products has the brand/model columns
+# added by scripts/migrate_add_product_fields.py.
+REQUIRED_TABLES = ("offer_stats", "products_fts", "products_norm_fts")
+REQUIRED_PRODUCT_COLUMNS = ("category_pretty",)
+
+def check_schema() -> None:
+    """Exit with instructions if the DB hasn't been migrated, rather than
+    starting up and failing every request."""
+    try:
+        with POOL.acquire() as con:
+            tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            # table_xinfo: category_pretty is a generated column, which
+            # table_info leaves out
+            columns = {r[1] for r in con.execute("PRAGMA table_xinfo(products)")}
+    except sqlite3.Error as e:
+        sys.exit(f"Cannot open {DB_PATH}: {e}")
+    missing = [t for t in REQUIRED_TABLES if t not in tables]
+    missing += [f"products.{c}" for c in REQUIRED_PRODUCT_COLUMNS if c not in columns]
+    if missing:
+        sys.exit(
+            f"{DB_PATH} is missing {', '.join(missing)}. Migrate it first:\n"
+            "  py scripts\\migrate_add_product_fields.py\n"
+            "  py scripts\\migrate.py"
+        )
+
+# ---------------- warm-up ----------------
+def warm_up() -> None:
+    """Open the pooled connections, pull the hot tables' pages into cache and
+    prime /categories and the default /products page, so the first requests
+    after boot aren't the ones paying for cold I/O."""
+    try:
+        POOL.fill()
+        with POOL.acquire() as con:
+            for table in ("offers", "products", "vendors", "offer_stats"):
+                con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        version = db_version()
+        _cached_categories(version)
+        _cached_products_page(version, ListQuery(search="", category="", page=1, limit=24))
+    except sqlite3.Error as e:
+        app.logger.warning("warm-up skipped: %s", e)
+
+check_schema()
+warm_up()
 
 if __name__ == "__main__":
     print(f"DB_PATH = {DB_PATH}")
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    if serve is not None and os.environ.get("FLASK_DEBUG") != "1":
+        # Threaded WSGI server; WAL lets its threads read SQLite concurrently.
+        serve(app, host="127.0.0.1", port=5000, threads=SERVER_THREADS)
+    else:
+        app.run(host="127.0.0.1", port=5000, threaded=True, debug=os.environ.get("FLASK_DEBUG") == "1")
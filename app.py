@@ -9,12 +9,13 @@ with modern versions of SQLAlchemy.
 
 from __future__ import annotations
 
-import decimal
 import os
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator
 
-from flask import Flask, jsonify, request
-from sqlalchemy import create_engine, text
+import orjson
+from flask import Flask, Response, request, stream_with_context
+from sqlalchemy import Float, bindparam, cast, column, create_engine, event, func, select, table
+from sqlalchemy.pool import QueuePool
 
 app = Flask(__name__)
 
@@ -22,8 +23,95 @@ app = Flask(__name__)
 DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///data/tooltally.db")
 
 # ``future=True`` enables SQLAlchemy 2.0 style usage and ensures ``Engine``
-# provides ``connect`` for context managed execution.
-engine = create_engine(DATABASE_URI, future=True)
+# provides ``connect`` for context managed execution.  Connections are kept
+# in a pool and reused across requests rather than reopened each time.
+engine = create_engine(
+    DATABASE_URI,
+    future=True,
+    poolclass=QueuePool,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=10,
+)
+
+# Per-connection SQLite tuning, applied once when the pool opens a connection.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+if engine.dialect.name == "sqlite":
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+# Lightweight table descriptions for building queries with SQLAlchemy Core.
+# Core statements are compiled once per structure and cached by SQLAlchemy,
+# so repeat requests skip SQL compilation entirely.
+products = table(
+    "products",
+    column("id"),
+    column("name"),
+    column("product_code"),
+    column("price"),
+    column("url"),
+    column("category"),
+    column("vendor_id"),
+)
+vendors = table("vendors", column("id"), column("name"))
+
+PRODUCT_SELECT = select(
+    products.c.id,
+    products.c.name,
+    products.c.product_code,
+    # CAST in SQL so drivers hand back floats (not Decimal for NUMERIC
+    # columns) and the JSON encoder needs no per-value fallback.
+    cast(products.c.price, Float).label("price"),
+    products.c.url,
+    products.c.category,
+    vendors.c.name.label("vendor_name"),
+).select_from(products.join(vendors, products.c.vendor_id == vendors.c.id))
+
+
+def _json(payload: Any, status: int = 200) -> Response:
+    """Serialise ``payload`` with orjson, which is much faster than ``jsonify``."""
+    body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+# Rows fetched and serialised per chunk when streaming list endpoints.
+STREAM_CHUNK_ROWS = 500
+
+
+def _stream_json_array(query, params: Dict[str, Any] | None = None, scalars: bool = False) -> Response:
+    """Stream the rows of ``query`` as a JSON array.
+
+    The list endpoints return whole tables, so rows are pulled from the
+    cursor and written out chunk by chunk instead of being collected into a
+    list and serialised in one go.
+    """
+
+    def generate() -> Iterator[bytes]:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query, params or {})
+            rows = result.scalars() if scalars else result.mappings()
+            sep = b"["
+            for chunk in rows.partitions(STREAM_CHUNK_ROWS):
+                yield sep + b",".join(
+                    orjson.dumps(r if scalars else dict(r)) for r in chunk
+                )
+                sep = b","
+            yield b"]" if sep == b"," else b"[]"
+
+    return app.response_class(stream_with_context(generate()), mimetype="application/json")
 
 
 @app.route("/")
@@ -39,87 +127,61 @@ def list_products():  # pragma: no cover - simple query wrapper
     search = request.args.get("search")
     category = request.args.get("category")
 
-    filters: List[str] = []
+    stmt = PRODUCT_SELECT
     params: Dict[str, Any] = {}
 
     if search:
-        filters.append("LOWER(p.name) LIKE :search")
+        if engine.dialect.name == "sqlite":
+            # SQLite's LIKE already folds ASCII case exactly as LOWER() does,
+            # so match the raw column: no per-row LOWER(), and the test runs
+            # against the idx_products_name entries before any table row is read.
+            stmt = stmt.where(products.c.name.like(bindparam("search")))
+        else:
+            # LIKE is case-sensitive elsewhere (e.g. Postgres): ILIKE there
+            stmt = stmt.where(products.c.name.ilike(bindparam("search")))
         params["search"] = f"%{search.lower()}%"
 
     if category:
         # Match categories case-insensitively so UI filters don't need exact casing
-        filters.append("LOWER(p.category) = :category")
-        params["category"] = category.lower()
-
-    where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
-
-    base_query = f"""
-        SELECT p.id, p.name, p.product_code, p.price, p.url, p.category,
-               v.name AS vendor_name
-        FROM products p
-        JOIN vendors v ON p.vendor_id = v.id
-        {where_clause}
-        ORDER BY p.name
-    """
-
-    with engine.connect() as conn:
-        result = conn.execute(text(base_query), params).mappings().all()
-
-    rows: List[Dict[str, Any]] = [dict(r) for r in result]
+        if engine.dialect.name == "sqlite":
+            # NOCASE compare can use the products(category COLLATE NOCASE) index
+            stmt = stmt.where(products.c.category.collate("nocase") == bindparam("category"))
+            params["category"] = category
+        else:
+            # Other backends have no NOCASE collation
+            stmt = stmt.where(func.lower(products.c.category) == bindparam("category"))
+            params["category"] = category.lower()
 
-    # ``decimal.Decimal`` instances are not JSON serialisable by default.
-    for row in rows:
-        if isinstance(row.get("price"), decimal.Decimal):
-            row["price"] = float(row["price"])
-
-    return jsonify(rows)
+    return _stream_json_array(stmt.order_by(products.c.name), params)
 
 
 @app.route("/products/<int:product_id>")
 def get_product(product_id: int):  # pragma: no cover - simple query wrapper
     """Return details for a single product."""
 
-    query = text(
-        """
-        SELECT p.id, p.name, p.product_code, p.price, p.url, p.category,
-               v.name AS vendor_name
-        FROM products p
-        JOIN vendors v ON p.vendor_id = v.id
-        WHERE p.id = :pid
-        """
-    )
+    query = PRODUCT_SELECT.where(products.c.id == bindparam("pid"))
 
     with engine.connect() as conn:
         result = conn.execute(query, {"pid": product_id}).mappings().first()
 
     if not result:
-        return jsonify({"error": "Product not found"}), 404
-
-    row = dict(result)
+        return _json({"error": "Product not found"}, 404)
 
-    if isinstance(row.get("price"), decimal.Decimal):
-        row["price"] = float(row["price"])
-
-    return jsonify(row)
+    return _json(dict(result))
 
 
 @app.route("/categories")
 def list_categories():  # pragma: no cover - simple query wrapper
     """Return a sorted list of distinct product categories."""
 
-    query = text(
-        """
-        SELECT DISTINCT category
-        FROM products
-        WHERE category IS NOT NULL AND category != ''
-        ORDER BY category
-        """
+    query = (
+        select(products.c.category)
+        .distinct()
+        .where(products.c.category.is_not(None), products.c.category != "")
+        .order_by(products.c.category)
     )
 
-    with engine.connect() as conn:
-        rows = conn.execute(query).scalars().all()
-
-    return jsonify(rows)
+    return _stream_json_array(query, scalars=True)
 
 
 if __name__ == "__main__":  # pragma: no cover
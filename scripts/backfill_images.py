@@ -6,10 +6,11 @@ Backfill product images by visiting vendor product pages and extracting og:image
 - Chooses one best image per product (first vendor with a valid absolute image).
 - Writes to products.image_url.
 - Skips products that already have a non-empty image_url unless --force is used.
+- Fetches pages concurrently (--workers threads); DB writes stay on the main thread.
 
 Usage:
-  pip install requests beautifulsoup4 lxml
-  py scripts\\backfill_images.py --limit 500
+  pip install requests lxml
+  py scripts\\backfill_images.py --limit 500 --workers 16
 """
 
 from __future__ import annotations
@@ -17,11 +18,16 @@ import argparse
 import re
 import sqlite3
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, Tuple
 from urllib.parse import urljoin, urlparse
 
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 DB_PATH = "data/tooltally.db"
 UA = (
@@ -29,15 +35,37 @@ UA = (
     "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 )
 
+def make_session(pool_size: int = 32) -> requests.Session:
+    # One keep-alive pool shared by all fetches (and worker threads), so
+    # repeat hits on a vendor host skip the TCP/TLS handshake.
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.headers["User-Agent"] = UA
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+SESSION = make_session()
+
 def open_db() -> sqlite3.Connection:
     con = sqlite3.connect(DB_PATH)
     con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL;")
+    # Idempotent, rerunnable bulk job: NORMAL skips the per-commit fsync
+    # (WAL keeps the DB consistent), and a bigger cache/mmap cuts read syscalls.
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    con.execute("PRAGMA cache_size=-65536;")
+    con.execute("PRAGMA mmap_size=268435456;")
     return con
 
-ABS_URL_RE = re.compile(r"^https?://", re.I)
-
 def is_abs(url: str) -> bool:
-    return bool(url and ABS_URL_RE.match(url))
+    # Scheme is case-insensitive; only the prefix needs lower-casing
+    return bool(url) and url[:8].lower().startswith(("http://", "https://"))
+
+IMG_EXT_RE = re.compile(r"\.(?:jpe?g|png|webp|gif)(?:\?|$)", re.I)
 
 def clean_img_src(src: Optional[str]) -> Optional[str]:
     if not src:
@@ -46,38 +74,83 @@ def clean_img_src(src: Optional[str]) -> Optional[str]:
     # common tracking/query junk could be removed here if needed
     return s or None
 
-def pick_from_meta(soup: BeautifulSoup, base_url: str) -> Optional[str]:
-    # Priority: og:image, twitter:image, meta[name=image], link[rel=image_src]
-    # then common product image selectors as fallback
-    # Gather candidates in order
-    metas = [
-        ('meta[property="og:image"]', 'content'),
-        ('meta[name="og:image"]', 'content'),
-        ('meta[name="twitter:image:src"]', 'content'),
-        ('meta[name="twitter:image"]', 'content'),
-        ('meta[name="image"]', 'content'),
-        ('link[rel="image_src"]', 'href'),
-    ]
-    for sel, attr in metas:
-        el = soup.select_one(sel)
-        if el:
-            src = clean_img_src(el.get(attr))
+# One parser per worker thread, reused for every page it fetches (lxml
+# parsers can't be shared across threads). Comments, PIs and the id index are
+# never used by the lookups below, so don't build them.
+_parsers = threading.local()
+
+def get_parser(encoding: Optional[str] = None) -> lxml.html.HTMLParser:
+    cache = getattr(_parsers, "by_encoding", None)
+    if cache is None:
+        cache = _parsers.by_encoding = {}
+    parser = cache.get(encoding)
+    if parser is None:
+        parser = cache[encoding] = lxml.html.HTMLParser(
+            encoding=encoding, remove_comments=True, remove_pis=True, collect_ids=False
+        )
+    return parser
+
+def parse_html(data: bytes, encoding: Optional[str] = None) -> Optional[lxml.html.HtmlElement]:
+    # Plain lxml + XPath: the lookups below are fixed attribute matches, so
+    # there's no need for a BeautifulSoup tree on top of lxml's own.
+    # Raw bytes go straight to libxml2, which decodes them itself (header
+    # charset if given, else the page's <meta charset>): no str round trip.
+    try:
+        try:
+            parser = get_parser(encoding)
+        except LookupError:
+            parser = get_parser()  # charset libxml2 doesn't know: let it sniff
+        return lxml.html.fromstring(data, parser=parser)
+    except etree.ParserError:
+        return None  # empty document
+
+CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.I)
+
+# Priority: og:image, twitter:image, meta[name=image], link[rel=image_src]
+HEAD_IMAGE_XPATHS = [
+    ('//meta[@property="og:image"]', 'content'),
+    ('//meta[@name="og:image"]', 'content'),
+    ('//meta[@name="twitter:image:src"]', 'content'),
+    ('//meta[@name="twitter:image"]', 'content'),
+    ('//meta[@name="image"]', 'content'),
+    ('//link[@rel="image_src"]', 'href'),
+]
+
+# Common product gallery-ish images, in order
+IMG_XPATHS = [
+    '//img[@id="main-image"]',
+    '//img[@itemprop="image"]',
+    '//img[contains(concat(" ", normalize-space(@class), " "), " product-image ")]',
+    '//img[contains(concat(" ", normalize-space(@class), " "), " product__image ")]',
+    '//img[contains(@src, "/product/")]',
+    '//img[contains(@src, "catalog")]',
+    '//img[contains(@class, "product")]',
+    '//img[contains(@class, "gallery")]',
+]
+
+def pick_from_head(root: Optional[lxml.html.HtmlElement], base_url: str) -> Optional[str]:
+    if root is None:
+        return None
+    for xpath, attr in HEAD_IMAGE_XPATHS:
+        els = root.xpath(xpath)
+        if els:
+            src = clean_img_src(els[0].get(attr))
             if src:
                 return src if is_abs(src) else urljoin(base_url, src)
+    return None
+
+def pick_from_meta(root: Optional[lxml.html.HtmlElement], base_url: str) -> Optional[str]:
+    # Meta tags first, then common product image selectors as fallback
+    if root is None:
+        return None
+    found = pick_from_head(root, base_url)
+    if found:
+        return found
 
     # Fallbacks: look for product gallery-ish selectors
     candidates = []
-    for sel in [
-        'img#main-image',
-        'img[itemprop="image"]',
-        'img.product-image',
-        'img.product__image',
-        'img[src*="/product/"]',
-        'img[src*="catalog"]',
-        'img[class*="product"]',
-        'img[class*="gallery"]',
-    ]:
-        for img in soup.select(sel):
+    for xpath in IMG_XPATHS:
+        for img in root.xpath(xpath):
             src = clean_img_src(img.get("src") or img.get("data-src") or img.get("data-original"))
             if src:
                 full = src if is_abs(src) else urljoin(base_url, src)
@@ -96,98 +169,97 @@ def pick_from_meta(soup: BeautifulSoup, base_url: str) -> Optional[str]:
 
     return None
 
+HEAD_END_RE = re.compile(rb"</head\s*>", re.I)
+HEAD_MAX_BYTES = 256 * 1024
+
 def fetch_image_from_page(url: str, timeout: int = 15) -> Optional[str]:
     try:
-        resp = requests.get(url, headers={"User-Agent": UA}, timeout=timeout)
+        # stream=True: headers arrive first, so non-HTML/error responses are
+        # dropped without downloading the body.
+        with SESSION.get(url, timeout=timeout, stream=True) as resp:
+            if resp.status_code >= 400 or "text/html" not in resp.headers.get("Content-Type", ""):
+                return None
+            m = CHARSET_RE.search(resp.headers["Content-Type"])
+            encoding = m.group(1) if m else None
+
+            # og:image & co. live in <head>: read up to </head> and parse just
+            # that, skipping the gallery-heavy body on most pages.
+            chunks = resp.iter_content(chunk_size=16384)
+            head = b""
+            for chunk in chunks:
+                tail = len(head)
+                head += chunk
+                if HEAD_END_RE.search(head, max(tail - 16, 0)) or len(head) > HEAD_MAX_BYTES:
+                    break
+            found = pick_from_head(parse_html(head, encoding), base_url=url)
+            if found:
+                return found
+
+            # No meta image: fall back to the whole page and its <img> tags.
+            page = head + b"".join(chunks)
     except requests.RequestException:
         return None
-    if resp.status_code >= 400 or "text/html" not in resp.headers.get("Content-Type", ""):
-        return None
-    soup = BeautifulSoup(resp.text, "lxml")
-    return pick_from_meta(soup, base_url=url)
-
-def pick_offer_url_for_product(cur: sqlite3.Cursor, pid_text: str) -> Optional[str]:
-    # Prefer offers that already have a URL and a non-zero price
-    cur.execute("""
-        SELECT o.url
-        FROM offers o
-        WHERE CAST(o.product_id AS TEXT) = ?
-          AND o.url IS NOT NULL AND o.url <> ''
-        ORDER BY
-          CASE WHEN (o.price_pounds IS NULL OR o.price_pounds=0) THEN 1 ELSE 0 END ASC,
-          o.vendor_id ASC,
-          o.id ASC
-        LIMIT 5
-    """, (pid_text,))
-    for row in cur.fetchall():
-        url = (row["url"] or "").strip()
-        if url and url.lower().startswith(("http://", "https://")):
-            return url
-    return None
+    return pick_from_meta(parse_html(page, encoding), base_url=url)
+
+# Each product with the offer page to visit, in one query: prefer offers
+# with a non-zero price, then lowest vendor/offer id. Only http(s) URLs count.
+PRODUCT_OFFER_SQL = """
+    SELECT p.id,
+           (SELECT TRIM(o.url)
+            FROM offers o
+            WHERE o.product_id = p.id
+              AND (TRIM(o.url) LIKE 'http://%' OR TRIM(o.url) LIKE 'https://%')
+            ORDER BY
+              CASE WHEN (o.price_pounds IS NULL OR o.price_pounds=0) THEN 1 ELSE 0 END ASC,
+              o.vendor_id ASC,
+              o.id ASC
+            LIMIT 1) AS offer_url
+    FROM products p
+    {where}
+    ORDER BY p.id ASC
+    LIMIT ?
+"""
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--limit", type=int, default=500, help="max products to process")
     parser.add_argument("--force", action="store_true", help="overwrite existing image_url")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent page fetches")
     args = parser.parse_args()
 
     con = open_db()
     cur = con.cursor()
 
-    # Pick products lacking image (or all with --force)
-    if args.force:
-        cur.execute("""
-            SELECT CAST(p.id AS TEXT) AS id
-            FROM products p
-            ORDER BY p.id ASC
-            LIMIT ?
-        """, (args.limit,))
-    else:
-        cur.execute("""
-            SELECT CAST(p.id AS TEXT) AS id
-            FROM products p
-            WHERE p.image_url IS NULL OR TRIM(p.image_url) = ''
-            ORDER BY p.id ASC
-            LIMIT ?
-        """, (args.limit,))
-
-    rows = cur.fetchall()
-    processed = 0
+    # Pick products lacking image (or all with --force), each with the page to visit
+    where = "" if args.force else "WHERE p.image_url IS NULL OR TRIM(p.image_url) = ''"
+    rows = cur.execute(PRODUCT_OFFER_SQL.format(where=where), (args.limit,)).fetchall()
+    processed = len(rows)
     updated = 0
+    jobs = [(r["id"], r["offer_url"]) for r in rows if r["offer_url"]]
 
-    for r in rows:
-        pid = r["id"]
-        processed += 1
+    # Fetch the pages concurrently. The run is bound by network round
+    # trips, so overlapping requests cuts wall time roughly by --workers.
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        futures = {pool.submit(fetch_image_from_page, url): pid for pid, url in jobs}
+        for fut in as_completed(futures):
+            pid = futures[fut]
+            img = fut.result()
+            if not img:
+                continue
 
-        # If not forcing, skip if already has image_url (defensive double-check)
-        if not args.force:
-            existing = cur.execute(
-                "SELECT image_url FROM products WHERE CAST(id AS TEXT)=?", (pid,)
-            ).fetchone()
-            if existing and existing["image_url"]:
+            # Basic sanity: absolute URL and looks like an image
+            p = urlparse(img)
+            if not p.scheme or not p.netloc:
                 continue
+            if not IMG_EXT_RE.search(img):
+                # Still allow if og:image without extension; most CDNs OK.
+                pass
 
-        offer_url = pick_offer_url_for_product(cur, pid)
-        if not offer_url:
-            continue
-
-        img = fetch_image_from_page(offer_url)
-        if not img:
-            continue
-
-        # Basic sanity: absolute URL and looks like an image
-        p = urlparse(img)
-        if not p.scheme or not p.netloc:
-            continue
-        if not re.search(r"\.(jpg|jpeg|png|webp|gif)(\?|$)", img, re.I):
-            # Still allow if og:image without extension; most CDNs OK.
-            pass
-
-        cur.execute("UPDATE products SET image_url=? WHERE CAST(id AS TEXT)=?", (img, pid))
-        updated += 1
-        if updated % 20 == 0:
-            con.commit()
-            print(f"Updated {updated} images…")
+            cur.execute("UPDATE products SET image_url=? WHERE id=?", (img, pid))
+            updated += 1
+            if updated % 20 == 0:
+                con.commit()
+                print(f"Updated {updated} images…")
 
     con.commit()
     con.close()
@@ -22,26 +22,37 @@ Safe to run multiple times.
 import os
 import re
 import sqlite3
+from multiprocessing import Pool
 from urllib.parse import urlparse
 
 DB_PATH = os.environ.get("DB_PATH") or os.path.join(os.path.dirname(__file__), "..", "data", "tooltally.db")
 DB_PATH = os.path.abspath(DB_PATH)
 
+# Rows per UPDATE batch/transaction; bounds WAL growth on big tables.
+BATCH_SIZE = 5000
+# Processes for the (CPU-bound) extraction pass; 1 runs it in-process.
+WORKERS = int(os.environ.get("WORKERS") or os.cpu_count() or 1)
+
 # --- Helpers -----------------------------------------------------------------
 
-def slug_from_url(url: str) -> str:
+def host_and_slug(url: str):
+    # One urlparse per row serves both the slug (for matching) and the host
+    # (for the summary).
     try:
-        path = urlparse(url).path or ""
-        slug = path.rsplit("/", 1)[-1]
-        return slug.lower()
+        parts = urlparse(url)
     except Exception:
-        return ""
+        return "", ""
+    slug = (parts.path or "").rsplit("/", 1)[-1]
+    return (parts.netloc or "").lower(), slug.lower()
+
+NON_TOKEN_RE = re.compile(r"[^A-Za-z0-9\-\/]")
+DASHES_RE = re.compile(r"-{2,}")
 
 def normalise_token(tok: str) -> str:
     # Keep letters/digits/[-/]
-    t = re.sub(r"[^A-Za-z0-9\-\/]", "", tok)
+    t = NON_TOKEN_RE.sub("", tok)
     # Collapse multiple dashes
-    t = re.sub(r"-{2,}", "-", t)
+    t = DASHES_RE.sub("-", t)
     # Uppercase for mpn storage
     return t.upper()
 
@@ -86,82 +97,151 @@ PATTERNS = [
     # Festool: TPC 18/4, TID 18/4 (normalize to TPC18-4)
     re.compile(r"\bT[IP][CD]\s*18\s*/\s*\d\b", re.I),
 ]
+FESTOOL = PATTERNS[-1]
 
 # Generic “token-ish” fallback:
 #   - ABC123, ABC123Z, GSB18V-55, GSR18V-60, DTW1002Z, etc.
 GENERIC = re.compile(r"\b[A-Z]{2,5}\d{2,4}[A-Z]{0,3}(?:-\d{1,3})?\b", re.I)
 
+# All of the above as one alternation: a single scan tells us whether any
+# pattern can match, so titles without a model code skip the 11 findall
+# passes. (Candidates still come from each pattern separately, since their
+# matches may overlap and pick_best wants them all.)
+ANY_MODEL_RE = re.compile("|".join(f"(?:{p.pattern})" for p in PATTERNS + [GENERIC]), re.I)
+
 def extract_candidates(text: str):
+    if not ANY_MODEL_RE.search(text):
+        return []
     cands = []
     for pat in PATTERNS:
         for m in pat.findall(text):
-            cands.append(normalise_token(m))
-    # Festool special form to normalize TPC 18/4 => TPC18-4
-    cands = [re.sub(r"\s*/\s*", "-", c) for c in cands]
+            tok = normalise_token(m)
+            if pat is FESTOOL:
+                # Festool special form to normalize TPC 18/4 => TPC18-4
+                # (normalise_token already dropped the spaces)
+                tok = tok.replace("/", "-")
+            cands.append(tok)
 
     for m in GENERIC.findall(text):
         cands.append(normalise_token(m))
     return cands
 
+# Brand guess for the summary: title substring -> brand, in priority order
+# (first listed wins when a title mentions several).
+BRAND_GUESSES = {
+    "makita": "Makita",
+    "dewalt": "DeWalt",
+    "de walt": "DeWalt",
+    "bosch": "Bosch",
+    "milwaukee": "Milwaukee",
+    "ryobi": "Ryobi",
+    "einhell": "Einhell",
+    "metabo": "Metabo",
+    "hikoki": "Hikoki",
+    "hitachi": "Hikoki",
+    "erbauer": "Erbauer",
+    "festool": "Festool",
+    "trend": "Trend",
+    "titan": "Titan",
+}
+BRAND_RANK = {k: i for i, k in enumerate(BRAND_GUESSES)}
+BRAND_RE = re.compile("|".join(re.escape(k) for k in BRAND_GUESSES))
+
+def guess_brand(title_lower: str) -> str:
+    # One scan for all brands instead of a substring test per brand
+    hits = BRAND_RE.findall(title_lower)
+    if not hits:
+        return ""
+    return BRAND_GUESSES[min(hits, key=BRAND_RANK.__getitem__)]
+
+def process_row(row):
+    """Extract the mpn for one (id, title, url) row; runs in a worker process."""
+    _id, title, url = row
+    title = title or ""
+    host, slug = host_and_slug(url)
+    hay = f"{title} {slug}"
+
+    cands = extract_candidates(hay)
+    mpn = pick_best(cands)
+
+    # Filter out obviously generic or too-short nonsense
+    if len(mpn) < 4:
+        return None
+    return _id, mpn, host, title
+
 def main():
     con = sqlite3.connect(DB_PATH)
     cur = con.cursor()
+    cur.execute("PRAGMA journal_mode=WAL;")
+    # Idempotent, rerunnable bulk job: NORMAL skips the per-commit fsync
+    # (WAL keeps the DB consistent), and a bigger cache/mmap cuts read syscalls.
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    cur.execute("PRAGMA temp_store=MEMORY;")
+    cur.execute("PRAGMA cache_size=-65536;")
+    cur.execute("PRAGMA mmap_size=268435456;")
 
     print(f"DB: {DB_PATH}")
 
+    # Partial index of the rows still missing an mpn: the SELECT below walks
+    # it instead of the whole table, and it shrinks as backfills land. Its
+    # WHERE must stay textually in step with the query's.
+    cur.execute("""
+      CREATE INDEX IF NOT EXISTS idx_raw_offers_no_mpn ON raw_offers(id)
+      WHERE mpn IS NULL OR mpn=''
+    """)
+    con.commit()
+
+    # Every pattern above needs at least one digit, so rows with none in
+    # title or URL can't yield a candidate: SQLite's GLOB drops them before
+    # they reach the Python regexes.
     rows = cur.execute("""
       SELECT id, title, url
       FROM raw_offers
       WHERE (mpn IS NULL OR mpn='')
+        AND (title GLOB '*[0-9]*' OR url GLOB '*[0-9]*')
     """).fetchall()
 
     updated = 0
     per_host = {}
     per_brand_guess = {}
-
-    for _id, title, url in rows:
-        title = title or ""
-        slug = slug_from_url(url)
-        hay = f"{title} {slug}"
-
-        cands = extract_candidates(hay)
-        mpn = pick_best(cands)
-
-        if not mpn:
-            continue
-
-        # Filter out obviously generic or too-short nonsense
-        if len(mpn) < 4:
+    updates = []
+
+    def flush():
+        cur.executemany("UPDATE raw_offers SET mpn=? WHERE id=?", updates)
+        con.commit()
+        updates.clear()
+
+    # Extraction is pure per-row regex work: fan it out across processes;
+    # this (single) process does all the writes. imap keeps row order so the
+    # summary is the same as a serial run. Small runs aren't worth the
+    # process start-up.
+    pool = Pool(WORKERS) if WORKERS > 1 and len(rows) > 2000 else None
+    results = pool.imap(process_row, rows, chunksize=2000) if pool else map(process_row, rows)
+
+    for res in results:
+        if res is None:
             continue
+        _id, mpn, host, title = res
 
-        # Update
-        cur.execute("UPDATE raw_offers SET mpn=? WHERE id=?", (mpn, _id))
+        # Update (batched)
+        updates.append((mpn, _id))
+        if len(updates) >= BATCH_SIZE:
+            flush()
         updated += 1
 
-        host = (urlparse(url).netloc or "").lower()
         per_host[host] = per_host.get(host, 0) + 1
 
         # naive brand guess from title
-        brand_guess = ""
-        tlow = title.lower()
-        if "makita" in tlow: brand_guess = "Makita"
-        elif "dewalt" in tlow or "de walt" in tlow: brand_guess = "DeWalt"
-        elif "bosch" in tlow: brand_guess = "Bosch"
-        elif "milwaukee" in tlow: brand_guess = "Milwaukee"
-        elif "ryobi" in tlow: brand_guess = "Ryobi"
-        elif "einhell" in tlow: brand_guess = "Einhell"
-        elif "metabo" in tlow: brand_guess = "Metabo"
-        elif "hikoki" in tlow or "hitachi" in tlow: brand_guess = "Hikoki"
-        elif "erbauer" in tlow: brand_guess = "Erbauer"
-        elif "festool" in tlow: brand_guess = "Festool"
-        elif "trend" in tlow: brand_guess = "Trend"
-        elif "titan" in tlow: brand_guess = "Titan"
+        brand_guess = guess_brand(title.lower())
 
         if brand_guess:
             key = f"{brand_guess}:{mpn}"
             per_brand_guess[key] = per_brand_guess.get(key, 0) + 1
 
-    con.commit()
+    if pool:
+        pool.close()
+        pool.join()
+    flush()
     con.close()
 
     print(f"Backfill complete. raw_offers.mpn updated for {updated} rows.")
@@ -2,45 +2,83 @@
 # Enrich raw_offers with EAN/GTIN and MPN by fetching product pages.
 # Targeted for hosts: toolstation.com, ukplanettools.co.uk, dm-tools.co.uk, screwfix.com
 #
-# Requires: requests, beautifulsoup4
+# Pages are fetched on WORKERS threads (default 16), at most PER_HOST (default
+# 4) at a time per host; DB writes stay on the main thread.
+#
+# Requires: requests, lxml (orjson optional, for faster JSON-LD parsing)
 
 import os
 import re
 import json
 import time
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain, zip_longest
 from urllib.parse import urlparse
 
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 DB_PATH = os.environ.get("DB_PATH") or os.path.join(os.path.dirname(__file__), "..", "data", "tooltally.db")
 DB_PATH = os.path.abspath(DB_PATH)
 
 TIMEOUT = 15
+# Found ids are written in one executemany/commit per this many URLs.
+FLUSH_EVERY = 500
+WORKERS = int(os.environ.get("WORKERS") or 16)
+PER_HOST = int(os.environ.get("PER_HOST") or 4)
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; ToolTallyBot/1.0; +https://example.com/bot) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
 }
 
+def make_session() -> requests.Session:
+    # Keep-alive pool shared by the worker threads: repeat fetches from a
+    # vendor reuse its connection instead of a new TCP/TLS handshake each.
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(32, WORKERS), max_retries=retry)
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+SESSION = make_session()
+
 # ---------- Normalisers ----------
 
+WS_RE = re.compile(r"\s+")
+MPN_CRUFT_RE = re.compile(r"\b(?:mpn|model|manufacturer part(?: number)?|part(?: number)?|sku)\b[:\s]*", re.I)
+MPN_JUNK_RE = re.compile(r"[^A-Za-z0-9\-/]")
+EAN_CRUFT_RE = re.compile(r"\b(?:ean|gtin|barcode)\b[:\s]*", re.I)
+NON_DIGIT_RE = re.compile(r"[^0-9]")
+
 def norm_text(s: str) -> str:
     if not s:
         return ""
-    return re.sub(r"\s+", " ", s).strip()
+    return WS_RE.sub(" ", s).strip()
 
 def norm_mpn(s: str) -> str:
     s = norm_text(s)
     # Common cruft
-    s = re.sub(r"\b(?:mpn|model|manufacturer part(?: number)?|part(?: number)?|sku)\b[:\s]*", "", s, flags=re.I)
+    s = MPN_CRUFT_RE.sub("", s)
     # Keep alnum + dashes/slashes only
-    s = re.sub(r"[^A-Za-z0-9\-/]", "", s)
+    s = MPN_JUNK_RE.sub("", s)
     return s[:64] if s else ""
 
 def norm_ean(s: str) -> str:
     s = norm_text(s)
-    s = re.sub(r"\b(?:ean|gtin|barcode)\b[:\s]*", "", s, flags=re.I)
-    s = re.sub(r"[^0-9]", "", s)
+    s = EAN_CRUFT_RE.sub("", s)
+    s = NON_DIGIT_RE.sub("", s)
     # Accept GTIN-8/12/13/14. Most UK sites use 13.
     if len(s) in (8, 12, 13, 14):
         return s
@@ -51,11 +89,38 @@ def norm_ean(s: str) -> str:
 EAN_PAT = re.compile(r"\b(?:EAN|GTIN|Barcode)\b[:\s]*([0-9\- ]{8,20})", re.I)
 MPN_PAT = re.compile(r"\b(?:MPN|Manufacturer(?:’s|s)? Part(?: No\.?| Number)?|Model|Product Code|Man(?:uf)?\.?\s*Code)\b[:\s]*([A-Z0-9\-\/]{3,64})", re.I)
 
-def from_json_ld(soup: BeautifulSoup):
+MPN_LABEL_RE = re.compile(r"\b(mpn|manufacturer|model|product code|sku)\b", re.I)
+EAN_LABEL_RE = re.compile(r"\b(ean|gtin|barcode)\b", re.I)
+# Substrings every label matching either regex contains: a plain `in` test
+# rules out most spec rows before any regex or value-cell text extraction.
+LABEL_HINTS = ("mpn", "manufacturer", "model", "product", "sku", "ean", "gtin", "barcode")
+
+def maybe_id_label(text: str) -> bool:
+    low = text.lower()
+    return any(h in low for h in LABEL_HINTS)
+
+# Text as bs4's get_text(" ") gives it: every text node, space-joined,
+# minus <script>/<style>/<template> contents (comments aren't text nodes).
+TEXT_XPATH = ".//text()[not(ancestor::script or ancestor::style or ancestor::template)]"
+
+def text_of(el) -> str:
+    return " ".join(el.xpath(TEXT_XPATH))
+
+def loads_json_ld(text: str):
+    # orjson (C) when installed; stdlib json still gets a go at anything it
+    # rejects (e.g. NaN, or integers past 64 bits).
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+def from_json_ld(root):
     mpn = ean = ""
-    for tag in soup.find_all("script", type="application/ld+json"):
+    for tag in root.xpath('//script[@type="application/ld+json"]'):
         try:
-            payload = json.loads(tag.string or "")
+            payload = loads_json_ld(tag.text or "")
         except Exception:
             continue
         # payload can be dict or list
@@ -71,54 +136,63 @@ def from_json_ld(soup: BeautifulSoup):
                 ean = norm_ean(str(ean_try))
     return mpn, ean
 
-def from_tables_by_labels(soup: BeautifulSoup):
+# Spec-list lookups are XPath (evaluated in C by lxml) rather than Python
+# tree walks: label-ish elements inside a <dl>, and the value sibling after each
+DL_TERMS_XPATH = "//dl//*[self::dt or self::th or self::strong or self::span]"
+DL_VALUE_XPATH = "following-sibling::*[self::dd or self::td or self::span][1]"
+
+def from_tables_by_labels(root):
     mpn = ean = ""
     # Look for definition lists or spec tables
     # dt/dd pairs
-    for dl in soup.find_all(["dl"]):
-        terms = dl.find_all(["dt", "th", "strong", "span"])
-        for t in terms:
-            label = norm_text(t.get_text(" "))
-            if not label:
-                continue
-            val_el = t.find_next_sibling(["dd", "td", "span"])
-            val = norm_text(val_el.get_text(" ")) if val_el else ""
-            if not val:
-                continue
-            if not mpn and re.search(r"\b(mpn|manufacturer|model|product code|sku)\b", label, re.I):
-                mpn = norm_mpn(val)
-            if not ean and re.search(r"\b(ean|gtin|barcode)\b", label, re.I):
-                ean = norm_ean(val)
-    # tables with rows
-    for table in soup.find_all("table"):
-        for tr in table.find_all("tr"):
-            th = tr.find(["th", "td"])
-            td = None
-            if th:
-                cand = th.find_next_sibling("td")
-                if not cand:
-                    tds = tr.find_all("td")
-                    if len(tds) >= 2:
-                        th, td = tds[0], tds[1]
-                    else:
-                        continue
-                else:
-                    td = cand
-            if not th or not td:
-                continue
-            label = norm_text(th.get_text(" "))
-            val = norm_text(td.get_text(" "))
-            if not val:
+    for t in root.xpath(DL_TERMS_XPATH):
+        raw_label = text_of(t)
+        if not maybe_id_label(raw_label):
+            continue
+        label = norm_text(raw_label)
+        val_el = t.xpath(DL_VALUE_XPATH)
+        val = norm_text(text_of(val_el[0])) if val_el else ""
+        if not val:
+            continue
+        if not mpn and MPN_LABEL_RE.search(label):
+            mpn = norm_mpn(val)
+        if not ean and EAN_LABEL_RE.search(label):
+            ean = norm_ean(val)
+        if mpn and ean:
+            return mpn, ean
+    # tables with rows: label is the row's first th/td, value the td after
+    # it (or, failing that, the row's first two tds)
+    for tr in root.xpath("//table//tr"):
+        th = tr.xpath("(.//th|.//td)[1]")
+        if not th:
+            continue
+        th = th[0]
+        cand = th.xpath("following-sibling::td[1]")
+        if cand:
+            td = cand[0]
+        else:
+            tds = tr.xpath(".//td")
+            if len(tds) < 2:
                 continue
-            if not mpn and re.search(r"\b(mpn|manufacturer|model|product code|sku)\b", label, re.I):
-                mpn = norm_mpn(val)
-            if not ean and re.search(r"\b(ean|gtin|barcode)\b", label, re.I):
-                ean = norm_ean(val)
+            th, td = tds[0], tds[1]
+        raw_label = text_of(th)
+        if not maybe_id_label(raw_label):
+            continue
+        label = norm_text(raw_label)
+        val = norm_text(text_of(td))
+        if not val:
+            continue
+        if not mpn and MPN_LABEL_RE.search(label):
+            mpn = norm_mpn(val)
+        if not ean and EAN_LABEL_RE.search(label):
+            ean = norm_ean(val)
+        if mpn and ean:
+            return mpn, ean
     return mpn, ean
 
-def from_free_text(soup: BeautifulSoup):
+def from_free_text(root):
     mpn = ean = ""
-    text = soup.get_text(" ")
+    text = text_of(root)
     m = EAN_PAT.search(text)
     if m and not ean:
         ean = norm_ean(m.group(1))
@@ -129,53 +203,53 @@ def from_free_text(soup: BeautifulSoup):
 
 # ---------- Host-specific helpers ----------
 
-def extract_toolstation(soup):
+def extract_toolstation(root):
     # Toolstation typically has JSON-LD with mpn and sometimes gtin13
-    mpn, ean = from_json_ld(soup)
+    mpn, ean = from_json_ld(root)
     if not (mpn or ean):
-        mpn2, ean2 = from_tables_by_labels(soup)
+        mpn2, ean2 = from_tables_by_labels(root)
         mpn = mpn or mpn2
         ean = ean or ean2
     if not (mpn or ean):
-        mpn3, ean3 = from_free_text(soup)
+        mpn3, ean3 = from_free_text(root)
         mpn = mpn or mpn3
         ean = ean or ean3
     return mpn, ean
 
-def extract_ukplanettools(soup):
+def extract_ukplanettools(root):
     # Often shows MPN/EAN in spec table or dd/dt pairs
-    mpn, ean = from_tables_by_labels(soup)
+    mpn, ean = from_tables_by_labels(root)
     if not (mpn or ean):
-        mpn2, ean2 = from_json_ld(soup)
+        mpn2, ean2 = from_json_ld(root)
         mpn = mpn or mpn2
         ean = ean or ean2
     if not (mpn or ean):
-        mpn3, ean3 = from_free_text(soup)
+        mpn3, ean3 = from_free_text(root)
         mpn = mpn or mpn3
         ean = ean or ean3
     return mpn, ean
 
-def extract_dmtools(soup):
-    mpn, ean = from_tables_by_labels(soup)
+def extract_dmtools(root):
+    mpn, ean = from_tables_by_labels(root)
     if not (mpn or ean):
-        mpn2, ean2 = from_json_ld(soup)
+        mpn2, ean2 = from_json_ld(root)
         mpn = mpn or mpn2
         ean = ean or ean2
     if not (mpn or ean):
-        mpn3, ean3 = from_free_text(soup)
+        mpn3, ean3 = from_free_text(root)
         mpn = mpn or mpn3
         ean = ean or ean3
     return mpn, ean
 
-def extract_screwfix(soup):
+def extract_screwfix(root):
     # Screwfix rarely exposes EAN; sometimes MPN in JSON-LD sku or spec table
-    mpn, ean = from_json_ld(soup)
+    mpn, ean = from_json_ld(root)
     if not (mpn or ean):
-        mpn2, ean2 = from_tables_by_labels(soup)
+        mpn2, ean2 = from_tables_by_labels(root)
         mpn = mpn or mpn2
         ean = ean or ean2
     if not (mpn or ean):
-        mpn3, ean3 = from_free_text(soup)
+        mpn3, ean3 = from_free_text(root)
         mpn = mpn or mpn3
         ean = ean or ean3
     return mpn, ean
@@ -198,6 +272,92 @@ def host_from_url(url: str) -> str:
     except Exception:
         return ""
 
+# One lxml parser per worker thread, reused for every page it handles
+_parsers = threading.local()
+
+def get_parser() -> lxml.html.HTMLParser:
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = _parsers.parser = lxml.html.HTMLParser(collect_ids=False)
+    return parser
+
+def parse_html(html: str):
+    try:
+        try:
+            return lxml.html.fromstring(html, parser=get_parser())
+        except ValueError:
+            # lxml refuses str input carrying an <?xml encoding=...?> declaration
+            return lxml.html.fromstring(html.encode("utf-8"), parser=get_parser())
+    except etree.ParserError:
+        return None  # empty document
+
+def extract_identifiers_from_html(html: str, extractor=None):
+    # The extractors are all XPath lookups on the lxml tree directly; no
+    # BeautifulSoup layer on top.
+    root = parse_html(html)
+    if root is None:
+        return "", ""
+    if extractor:
+        return extractor(root)
+    # generic fallback
+    m1, e1 = from_json_ld(root)
+    m2, e2 = from_tables_by_labels(root)
+    m3, e3 = from_free_text(root)
+    return m1 or m2 or m3, e1 or e2 or e3
+
+# Extractors (None = the generic fallback) that take JSON-LD before any other
+# source. For these, JSON-LD in <head> that already carries both ids gives the
+# same answer as the full page: head scripts come first in document order, and
+# from_json_ld keeps the first value it sees. The table-first extractors always
+# need the full page, since a spec table further down outranks head JSON-LD.
+JSON_LD_FIRST = {None, extract_toolstation, extract_screwfix}
+
+HEAD_END_RE = re.compile(rb"</head\s*>", re.I)
+# A complete JSON-LD block carrying a gtin, for pages that put it in <body>
+GTIN_SCRIPT_RE = re.compile(rb"gtin[^<]*</script", re.I)
+HEAD_MAX_BYTES = 256 * 1024
+# Hard cap on the full-page fallback, so one huge page can't stall a worker
+BODY_MAX_BYTES = 2 * 1024 * 1024
+
+def fetch_identifiers(url: str, host_slot: threading.Semaphore):
+    """Fetch one page and pull (mpn, ean) out of it; runs on a worker thread."""
+    extractor = HOST_EXTRACTORS.get(host_from_url(url))
+    # The host slot is held for the whole exchange with the vendor, including
+    # the <head> parse that decides whether the rest of the body is needed.
+    # The full-page fallback is parsed after the slot (and connection) are
+    # released, so that larger parse doesn't stall the next fetch from the host.
+    with host_slot, SESSION.get(url, timeout=TIMEOUT, stream=True) as resp:
+        # Headers arrive first: PDFs, images etc. are dropped without
+        # downloading the body.
+        ctype = resp.headers.get("Content-Type", "")
+        if ctype and "html" not in ctype.lower():
+            return "", ""
+        encoding = resp.encoding or "utf-8"
+        # JSON-LD / microdata ids almost always sit in <head>: read up to
+        # </head> (or a finished gtin script) and try that alone first.
+        chunks = resp.iter_content(chunk_size=16384)
+        head = b""
+        for chunk in chunks:
+            tail = max(len(head) - 16, 0)
+            head += chunk
+            if (HEAD_END_RE.search(head, tail) or GTIN_SCRIPT_RE.search(head)
+                    or len(head) > HEAD_MAX_BYTES):
+                break
+        if extractor in JSON_LD_FIRST:
+            root = parse_html(head.decode(encoding, "replace"))
+            if root is not None:
+                mpn, ean = from_json_ld(root)
+                if mpn and ean:
+                    return mpn, ean
+        # Anything less than both ids from a JSON-LD-first head could still be
+        # outranked or completed further down: use the full page.
+        body = head
+        for chunk in chunks:
+            body += chunk
+            if len(body) > BODY_MAX_BYTES:
+                break
+    return extract_identifiers_from_html(body.decode(encoding, "replace"), extractor)
+
 def main():
     allow_env = os.environ.get("ALLOW", "")
     allow_list = [h.strip().lower() for h in allow_env.split(",") if h.strip()] or list(HOST_EXTRACTORS.keys())
@@ -206,83 +366,114 @@ def main():
 
     con = sqlite3.connect(DB_PATH)
     cur = con.cursor()
+    cur.execute("PRAGMA journal_mode=WAL;")
+    # Idempotent, rerunnable bulk job: NORMAL skips the per-commit fsync
+    # (WAL keeps the DB consistent), and a bigger cache/mmap cuts read syscalls.
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    cur.execute("PRAGMA temp_store=MEMORY;")
+    cur.execute("PRAGMA cache_size=-65536;")
+    cur.execute("PRAGMA mmap_size=268435456;")
+
+    # Partial index holding just the URLs still missing both ids: the
+    # candidate query below reads it (already DISTINCT-ordered by url)
+    # instead of scanning raw_offers, and it shrinks as enrichment lands.
+    # Its WHERE must stay textually in step with the query's.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_raw_offers_needs_ids ON raw_offers(url)
+        WHERE (ean_gtin IS NULL OR ean_gtin='') AND (mpn IS NULL OR mpn='')
+    """)
+    con.commit()
 
-    # Candidate URLs: missing BOTH mpn and ean
+    # Candidate URLs: missing BOTH mpn and ean, on an allowed host. The LIKE
+    # patterns let SQLite drop other vendors' rows; host_from_url still has
+    # the final say (LIKE is only a superset: "//host" can appear elsewhere).
+    host_patterns = [p for h in allow_list for p in (f"%//{h}%", f"%//www.{h}%")]
+    host_filter = " OR ".join("url LIKE ?" for _ in host_patterns)
     urls = []
-    for (url,) in cur.execute("""
+    for (url,) in cur.execute(f"""
         SELECT DISTINCT url
         FROM raw_offers
         WHERE (ean_gtin IS NULL OR ean_gtin='')
           AND (mpn IS NULL OR mpn='')
-    """):
+          AND ({host_filter})
+    """, host_patterns):
         h = host_from_url(url)
         if h in allow_list:
             urls.append(url)
+            if limit is not None and len(urls) >= limit:
+                break
 
-    if limit is not None:
-        urls = urls[:limit]
+    # Round-robin across hosts (URLs arrive sorted, i.e. grouped by host) so
+    # the workers spread over every vendor's connections instead of queueing
+    # on one host's PER_HOST slots.
+    by_host = {}
+    for url in urls:
+        by_host.setdefault(host_from_url(url), []).append(url)
+    urls = [u for u in chain.from_iterable(zip_longest(*by_host.values())) if u is not None]
 
     print(f"DB: {DB_PATH}")
     print(f"[{time.strftime('%Y-%m-%dT%H:%M:%S%z')}] Found {len(urls)} URLs to enrich from hosts: {', '.join(allow_list)}")
 
     found_both = found_mpn = found_ean = found_none = 0
     updated_rows = 0
+    pending = []
+
+    def flush():
+        nonlocal updated_rows
+        if pending:
+            cur.executemany("""
+                UPDATE raw_offers
+                SET ean_gtin=COALESCE(NULLIF(ean_gtin,''), ?),
+                    mpn=COALESCE(NULLIF(mpn,''), ?)
+                WHERE url=?
+            """, pending)
+            updated_rows += cur.rowcount
+            pending.clear()
+        con.commit()
+
+    # The run is bound by page round trips: overlap them across hosts while
+    # keeping each vendor to PER_HOST concurrent requests.
+    host_slots = {h: threading.BoundedSemaphore(PER_HOST) for h in allow_list}
+    pool = ThreadPoolExecutor(max_workers=max(WORKERS, 1))
+    futures = {pool.submit(fetch_identifiers, url, host_slots[host_from_url(url)]): url for url in urls}
 
-    for idx, url in enumerate(urls, 1):
-        h = host_from_url(url)
-        extractor = HOST_EXTRACTORS.get(h)
-        try:
-            resp = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-            html = resp.text
-            soup = BeautifulSoup(html, "html.parser")
-
-            mpn = ean = ""
-            if extractor:
-                mpn, ean = extractor(soup)
-            else:
-                # generic fallback
-                m1, e1 = from_json_ld(soup)
-                m2, e2 = from_tables_by_labels(soup)
-                m3, e3 = from_free_text(soup)
-                mpn = m1 or m2 or m3
-                ean = e1 or e2 or e3
-
-            if mpn and ean:
-                found_both += 1
-                status = "mpn+ean"
-            elif mpn:
-                found_mpn += 1
-                status = "mpn"
-            elif ean:
-                found_ean += 1
-                status = "ean"
-            else:
-                found_none += 1
-                status = "no-ids"
-
-            if mpn or ean:
-                cur.execute("""
-                    UPDATE raw_offers
-                    SET ean_gtin=COALESCE(NULLIF(ean_gtin,''), ?),
-                        mpn=COALESCE(NULLIF(mpn,''), ?)
-                    WHERE url=?
-                """, (ean or None, mpn or None, url))
-                updated_rows += cur.rowcount
-
-            # Log every 50 URLs
-            if idx % 50 == 0 or not (mpn or ean):
-                print(f" {idx}/{len(urls)} {status} {url}")
-
-            if idx % 200 == 0:
-                con.commit()
-
-        except KeyboardInterrupt:
-            print("\nInterrupted by user. Committing progress…")
-            break
-        except Exception as e:
-            print(f" {idx}/{len(urls)} ERROR {h} {url} :: {e}")
-
-    con.commit()
+    try:
+        for idx, fut in enumerate(as_completed(futures), 1):
+            url = futures[fut]
+            h = host_from_url(url)
+            try:
+                mpn, ean = fut.result()
+
+                if mpn and ean:
+                    found_both += 1
+                    status = "mpn+ean"
+                elif mpn:
+                    found_mpn += 1
+                    status = "mpn"
+                elif ean:
+                    found_ean += 1
+                    status = "ean"
+                else:
+                    found_none += 1
+                    status = "no-ids"
+
+                if mpn or ean:
+                    pending.append((ean or None, mpn or None, url))
+                    if len(pending) >= FLUSH_EVERY:
+                        flush()
+
+                # Log every 50 URLs
+                if idx % 50 == 0 or not (mpn or ean):
+                    print(f" {idx}/{len(urls)} {status} {url}")
+
+            except Exception as e:
+                print(f" {idx}/{len(urls)} ERROR {h} {url} :: {e}")
+    except KeyboardInterrupt:
+        print("\nInterrupted by user. Committing progress…")
+
+    # Drop anything still queued (after Ctrl+C); in-flight fetches just finish.
+    pool.shutdown(wait=False, cancel_futures=True)
+    flush()
     con.close()
 
     print(f"[{time.strftime('%Y-%m-%dT%H:%M:%S%z')}] Enrichment finished. "
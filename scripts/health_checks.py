@@ -18,20 +18,31 @@ def one(cur, q: str) -> int:
     row = cur.fetchone()
     return 0 if row is None else (row[0] or 0)
 
+def has_table(cur, name: str) -> bool:
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cur.fetchone() is not None
+
 def main():
     con = sqlite3.connect(DB_PATH)
     cur = con.cursor()
+    # Per-product vendor counts come from offer_stats (kept current by the
+    # triggers in scripts/migrate.py) rather than COUNT(DISTINCT) over offers.
+    # A raw scraped DB that migrate.py hasn't touched yet has no offer_stats:
+    # aggregate offers directly there.
+    use_stats = has_table(cur, "offer_stats")
 
     print("=== Basic counts ===")
-    stats = [
-        ("raw_offers rows", "SELECT COUNT(*) FROM raw_offers"),
-        ("raw_offers unprocessed", "SELECT COUNT(*) FROM raw_offers WHERE processed=0"),
-        ("products rows", "SELECT COUNT(*) FROM products"),
-        ("offers rows", "SELECT COUNT(*) FROM offers"),
-        ("vendors rows", "SELECT COUNT(*) FROM vendors"),
-    ]
-    for label, q in stats:
-        print(f"{label:24s}: {one(cur, q)}")
+    # One statement, one pass per table (both raw_offers counts share a scan)
+    q_counts = dedent(r"""
+        SELECT r.n, r.unprocessed,
+               (SELECT COUNT(*) FROM products),
+               (SELECT COUNT(*) FROM offers),
+               (SELECT COUNT(*) FROM vendors)
+        FROM (SELECT COUNT(*) AS n, SUM(processed=0) AS unprocessed FROM raw_offers) r
+    """).strip()
+    labels = ["raw_offers rows", "raw_offers unprocessed", "products rows", "offers rows", "vendors rows"]
+    for label, n in zip(labels, cur.execute(q_counts).fetchone()):
+        print(f"{label:24s}: {n or 0}")
 
     print("\n=== Cross-vendor MPN overlap in raw_offers ===")
     q_overlap = dedent(r"""
@@ -47,35 +58,49 @@ def main():
     print("Cross-vendor MPN keys:", one(cur, q_overlap))
 
     print("\n=== Multi-vendor products (post-resolve) ===")
-    q_multivendor = dedent(r"""
-        SELECT COUNT(*) FROM (
-          SELECT product_id, COUNT(DISTINCT vendor_id) AS vc
-          FROM offers
-          GROUP BY product_id
-          HAVING vc > 1
-        )
-    """).strip()
+    if use_stats:
+        q_multivendor = "SELECT COUNT(*) FROM offer_stats WHERE vendors_count > 1"
+    else:
+        q_multivendor = dedent(r"""
+            SELECT COUNT(*) FROM (
+              SELECT product_id, COUNT(DISTINCT vendor_id) AS vc
+              FROM offers
+              GROUP BY product_id
+              HAVING vc > 1
+            )
+        """).strip()
     print("Products with >1 vendor:", one(cur, q_multivendor))
 
     print("\n=== Products by fingerprint type ===")
-    by_fp = [
-        ("ean",   "SELECT COUNT(*) FROM products WHERE fingerprint LIKE 'ean:%'"),
-        ("mpn",   "SELECT COUNT(*) FROM products WHERE fingerprint LIKE 'mpn:%'"),
-        ("model", "SELECT COUNT(*) FROM products WHERE fingerprint LIKE 'model:%'"),
-        ("other/NULL", "SELECT COUNT(*) FROM products WHERE fingerprint IS NULL OR fingerprint=''"),
-    ]
-    for label, q in by_fp:
-        print(f"{label:11s}: {one(cur, q)}")
+    q_fp = dedent(r"""
+        SELECT SUM(fingerprint LIKE 'ean:%'),
+               SUM(fingerprint LIKE 'mpn:%'),
+               SUM(fingerprint LIKE 'model:%'),
+               SUM(fingerprint IS NULL OR fingerprint='')
+        FROM products
+    """).strip()
+    labels = ["ean", "mpn", "model", "other/NULL"]
+    for label, n in zip(labels, cur.execute(q_fp).fetchone()):
+        print(f"{label:11s}: {n or 0}")
 
     print("\n=== Top 25 biggest vendor clusters ===")
-    q_top = dedent(r"""
-        SELECT p.id, substr(p.name,1,80) AS title, COUNT(DISTINCT o.vendor_id) AS vendors, p.fingerprint
-        FROM products p
-        JOIN offers o ON o.product_id = p.id
-        GROUP BY p.id
-        ORDER BY vendors DESC, p.id
-        LIMIT 25
-    """).strip()
+    if use_stats:
+        q_top = dedent(r"""
+            SELECT p.id, substr(p.name,1,80) AS title, s.vendors_count AS vendors, p.fingerprint
+            FROM offer_stats s
+            JOIN products p ON p.id = s.product_id
+            ORDER BY vendors DESC, p.id
+            LIMIT 25
+        """).strip()
+    else:
+        q_top = dedent(r"""
+            SELECT p.id, substr(p.name,1,80) AS title, COUNT(DISTINCT o.vendor_id) AS vendors, p.fingerprint
+            FROM products p
+            JOIN offers o ON o.product_id = p.id
+            GROUP BY p.id
+            ORDER BY vendors DESC, p.id
+            LIMIT 25
+        """).strip()
     for row in cur.execute(q_top):
         pid, title, vendors, fp = row
         print(f"#{pid:>6}  v={vendors}  fp={fp}  {title}")
@@ -97,7 +122,7 @@ def main():
           WHERE mpn_norm IS NOT NULL
           GROUP BY mpn_norm
           HAVING prod_cnt >= 2
-          ORDER BY prod_cnt DESC
+          ORDER BY prod_cnt DESC, mpn_norm
           LIMIT 25
         )
         SELECT * FROM agg
@@ -105,6 +130,23 @@ def main():
     for row in cur.execute(q_split):
         print("MPN split suspect:", row)
 
+    print("\n=== Offer lookup plan (API best-offer-per-vendor) ===")
+    # Should read from the (product_id, vendor_id, has-url, has-price, price, id)
+    # index created by scripts/migrate.py, with no temp b-tree sort.
+    q_plan = dedent(r"""
+        EXPLAIN QUERY PLAN
+        SELECT id FROM offers
+        WHERE product_id = ? AND vendor_id = ?
+        ORDER BY (url IS NULL OR url='') ASC, (price_pounds IS NULL OR price_pounds=0) ASC,
+                 price_pounds ASC, id ASC
+        LIMIT 1
+    """).strip()
+    plan = [row[3] for row in cur.execute(q_plan, (0, 0))]
+    for detail in plan:
+        print("  " + detail)
+    if any("TEMP B-TREE" in d for d in plan):
+        print("WARNING: offers lookup sorts per request; run scripts/migrate.py to add its index")
+
     con.close()
 
 
@@ -5,16 +5,25 @@ Ensure SQLite schema for ToolTally.
 - Creates required tables if missing.
 - Migrates existing tables to include missing columns (e.g., offers.created_at).
 - Ensures helpful indexes.
+- Maintains offer_stats (per-product offer aggregates read by the APIs).
+- Maintains products_fts (trigram full-text index used for API search).
+- Adds products.name_norm / model_norm (indexed, upper-cased, space/dash-free)
+  and products_norm_fts (trigram index over them for model-code search).
+- Adds products.category_pretty (indexed display form of category, shared by
+  /categories and the category filter).
 - Enables WAL for better read/write behavior.
 
 Usage:
   py scripts\migrate.py
+  py scripts\migrate.py --for-bulk-load     # ensure schema, then drop BULK_INDEXES
+  py scripts\migrate.py --rebuild-indexes   # recreate BULK_INDEXES after the load
 """
 
 from __future__ import annotations
 
 import os
 import sqlite3
+import sys
 from typing import Set
 
 DB_PATH = os.environ.get("DB_PATH", os.path.join("data", "tooltally.db"))
@@ -27,8 +36,31 @@ REQUIRED_TABLES = {
     "meta",
 }
 
+# Per-product aggregates over offers, shared by the full refresh and the triggers.
+#   min_price / vendors_count:          all offers
+#   lowest_price / url_vendor_count:    only offers with a product URL (and a non-zero price)
+OFFER_STATS_SELECT = """
+    SELECT product_id,
+           MIN(price_pounds),
+           COUNT(DISTINCT vendor_id),
+           MIN(CASE WHEN url IS NOT NULL AND url <> '' AND price_pounds <> 0 THEN price_pounds END),
+           COUNT(DISTINCT CASE WHEN url IS NOT NULL AND url <> '' THEN vendor_id END)
+    FROM offers
+"""
+
+OFFER_STATS_COLUMNS = "product_id, min_price, vendors_count, lowest_price, url_vendor_count"
+
+# Non-unique raw_offers indexes: pure overhead (a B-tree insert per row) while
+# scrapers bulk-load, so a load can drop them and build each once afterwards.
+# idx_raw_unique stays, since the scrapers' upsert conflicts on it.
+BULK_INDEXES = {
+    "idx_raw_offers_vendor": "CREATE INDEX IF NOT EXISTS idx_raw_offers_vendor ON raw_offers(vendor)",
+    "idx_raw_offers_url": "CREATE INDEX IF NOT EXISTS idx_raw_offers_url ON raw_offers(url)",
+}
+
 def _get_columns(con: sqlite3.Connection, table: str) -> Set[str]:
-    cur = con.execute(f"PRAGMA table_info('{table}')")
+    # table_xinfo (unlike table_info) also lists generated columns
+    cur = con.execute(f"PRAGMA table_xinfo('{table}')")
     cols = {row[1] for row in cur.fetchall()}
     cur.close()
     return cols
@@ -89,6 +121,17 @@ def ensure_schema(con: sqlite3.Connection) -> None:
     )
     """)
 
+    # offer_stats: materialized per-product offer aggregates
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS offer_stats (
+        product_id INTEGER PRIMARY KEY,
+        min_price REAL,
+        vendors_count INTEGER NOT NULL DEFAULT 0,
+        lowest_price REAL,
+        url_vendor_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
     # meta: optional key/value store
     cur.execute("""
     CREATE TABLE IF NOT EXISTS meta (
@@ -120,23 +163,232 @@ def ensure_schema(con: sqlite3.Connection) -> None:
     # --- Indexes ---
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendors_name ON vendors(name)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)")
+    # resolver.py's get_or_create_product falls back to a case-insensitive
+    # name match; without this it scans products for every such cluster.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_products_name_lower ON products(lower(name))")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_product ON offers(product_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_vendor ON offers(vendor_id)")
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_offers_url ON offers(url)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_raw_offers_vendor ON raw_offers(vendor)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_raw_offers_url ON raw_offers(url)")
+    create_bulk_indexes(con)
+    # Covering indexes for the API read paths: per-product aggregation, the
+    # per-vendor "best offer" window in get_offers, and category/name listings.
+    cur.execute("CREATE INDEX IF NOT EXISTS offers_prod_vendor_price ON offers(product_id, vendor_id, price_pounds, id)")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS offers_prod_hasurl_price ON offers(
+        product_id, vendor_id,
+        (url IS NULL OR url=''), (price_pounds IS NULL OR price_pounds=0),
+        price_pounds, id
+    )
+    """)
+    # Normalised-MPN groupings in health_checks.py (cross-vendor overlap and
+    # split suspects) read this in key order instead of computing the key per
+    # row and sorting. mpn arrives with the enrichment/backfill scripts.
+    if "mpn" in _get_columns(con, "raw_offers"):
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_raw_mpn_norm
+        ON raw_offers(UPPER(REPLACE(REPLACE(mpn,'-',''),' ','')), vendor)
+        WHERE mpn IS NOT NULL AND TRIM(mpn) <> ''
+        """)
+    cur.execute("CREATE INDEX IF NOT EXISTS products_category_name ON products(category, name COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS products_category_nocase ON products(category COLLATE NOCASE)")
+    con.commit()
+
+    # Default /products ranking, read in index order instead of sorted per request.
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS offer_stats_rank
+    ON offer_stats(url_vendor_count DESC, lowest_price, product_id)
+    """)
+    con.commit()
+
+    # --- offer_stats maintenance ---
+    # Recompute the touched product's row whenever offers change, so readers
+    # never aggregate the offers table themselves.
+    for event, refs in (("INSERT", ("NEW",)), ("DELETE", ("OLD",)), ("UPDATE", ("OLD", "NEW"))):
+        body = "".join(
+            f"""
+          DELETE FROM offer_stats WHERE product_id = {ref}.product_id;
+          INSERT INTO offer_stats ({OFFER_STATS_COLUMNS})
+          {OFFER_STATS_SELECT} WHERE product_id = {ref}.product_id GROUP BY product_id;"""
+            for ref in refs
+        )
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS offers_stats_{event.lower()} AFTER {event} ON offers BEGIN{body}
+        END
+        """)
+    con.commit()
+
+    refresh_offer_stats(con)
+    _ensure_category_pretty(con)
+
+    # --- products_fts: trigram index so substring search doesn't scan products ---
+    # (brand/model come from migrate_add_product_fields.py)
+    if {"brand", "model"} <= _get_columns(con, "products"):
+        _ensure_products_fts(con)
+        _ensure_norm_columns(con)
+        # resolver.py's last-resort (brand, model, voltage) product match
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_brand_model_volt ON products(brand, model, voltage)")
+        con.commit()
+
+    # Refresh planner statistics so the indexes above actually get picked.
+    cur.execute("ANALYZE")
+    con.commit()
+    cur.close()
+
+def _ensure_products_fts(con: sqlite3.Connection) -> None:
+    cur = con.cursor()
+    fts_is_new = not _table_exists(con, "products_fts")
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, brand, category, model,
+        content='products', content_rowid='id', tokenize='trigram'
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+      INSERT INTO products_fts(rowid, name, brand, category, model)
+      VALUES (new.id, new.name, new.brand, new.category, new.model);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+      INSERT INTO products_fts(products_fts, rowid, name, brand, category, model)
+      VALUES ('delete', old.id, old.name, old.brand, old.category, old.model);
+    END
+    """)
+    # Only the indexed columns: image_url/price/etc. writes must not rewrite
+    # the FTS row. Replace the older trigger that fired on any UPDATE.
+    row = cur.execute(
+        "SELECT sql FROM sqlite_master WHERE type='trigger' AND name='products_fts_au'"
+    ).fetchone()
+    if row and "UPDATE OF" not in row[0].upper():
+        cur.execute("DROP TRIGGER products_fts_au")
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, brand, category, model ON products BEGIN
+      INSERT INTO products_fts(products_fts, rowid, name, brand, category, model)
+      VALUES ('delete', old.id, old.name, old.brand, old.category, old.model);
+      INSERT INTO products_fts(rowid, name, brand, category, model)
+      VALUES (new.id, new.name, new.brand, new.category, new.model);
+    END
+    """)
+    if fts_is_new:
+        cur.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        print("Migrated: built products_fts")
+    con.commit()
+    cur.close()
+
+def _ensure_norm_columns(con: sqlite3.Connection) -> None:
+    # SQLite can only ALTER in VIRTUAL generated columns; the index stores the
+    # computed values, so model-code search reads them instead of running
+    # UPPER/REPLACE on every row.
+    cur = con.cursor()
+    cols = _get_columns(con, "products")
+    if "name_norm" not in cols:
+        cur.execute("""
+        ALTER TABLE products ADD COLUMN name_norm TEXT
+        GENERATED ALWAYS AS (REPLACE(REPLACE(UPPER(name),' ',''),'-','')) VIRTUAL
+        """)
+        print("Migrated: added products.name_norm")
+    if "model_norm" not in cols:
+        cur.execute("""
+        ALTER TABLE products ADD COLUMN model_norm TEXT
+        GENERATED ALWAYS AS (REPLACE(REPLACE(UPPER(COALESCE(model,'')),' ',''),'-','')) VIRTUAL
+        """)
+        print("Migrated: added products.model_norm")
+    cur.execute("CREATE INDEX IF NOT EXISTS products_name_norm ON products(name_norm)")
+    cur.execute("CREATE INDEX IF NOT EXISTS products_model_norm ON products(model_norm)")
+
+    # Trigram index over the normalised forms: "DHP 484" / "dhp-484" style
+    # searches become an FTS probe instead of a scan.
+    fts_is_new = not _table_exists(con, "products_norm_fts")
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_norm_fts USING fts5(
+        name_norm, model_norm,
+        content='products', content_rowid='id', tokenize='trigram'
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_norm_fts_ai AFTER INSERT ON products BEGIN
+      INSERT INTO products_norm_fts(rowid, name_norm, model_norm)
+      VALUES (new.id, new.name_norm, new.model_norm);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_norm_fts_ad AFTER DELETE ON products BEGIN
+      INSERT INTO products_norm_fts(products_norm_fts, rowid, name_norm, model_norm)
+      VALUES ('delete', old.id, old.name_norm, old.model_norm);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_norm_fts_au AFTER UPDATE OF name, model ON products BEGIN
+      INSERT INTO products_norm_fts(products_norm_fts, rowid, name_norm, model_norm)
+      VALUES ('delete', old.id, old.name_norm, old.model_norm);
+      INSERT INTO products_norm_fts(rowid, name_norm, model_norm)
+      VALUES (new.id, new.name_norm, new.model_norm);
+    END
+    """)
+    if fts_is_new:
+        cur.execute("INSERT INTO products_norm_fts(products_norm_fts) VALUES ('rebuild')")
+        print("Migrated: built products_norm_fts")
     con.commit()
+    cur.close()
 
+def _ensure_category_pretty(con: sqlite3.Connection) -> None:
+    # Category as the API shows it: trimmed, first letter upper-cased, blank
+    # -> 'Uncategorized'. Indexed, so /categories is a grouped index scan and
+    # ?category= an equality lookup instead of evaluating this per row.
+    cur = con.cursor()
+    if "category_pretty" not in _get_columns(con, "products"):
+        cur.execute("""
+        ALTER TABLE products ADD COLUMN category_pretty TEXT
+        GENERATED ALWAYS AS (
+          CASE
+            WHEN TRIM(COALESCE(category,'')) = '' THEN 'Uncategorized'
+            ELSE UPPER(SUBSTR(TRIM(category),1,1)) || LOWER(SUBSTR(TRIM(category),2))
+          END
+        ) VIRTUAL
+        """)
+        print("Migrated: added products.category_pretty")
+    cur.execute("CREATE INDEX IF NOT EXISTS products_category_pretty ON products(category_pretty)")
+    con.commit()
+    cur.close()
+
+def drop_bulk_indexes(con: sqlite3.Connection) -> None:
+    for name in BULK_INDEXES:
+        con.execute(f"DROP INDEX IF EXISTS {name}")
+    con.commit()
+
+def create_bulk_indexes(con: sqlite3.Connection) -> None:
+    for sql in BULK_INDEXES.values():
+        con.execute(sql)
+    con.commit()
+
+def refresh_offer_stats(con: sqlite3.Connection) -> None:
+    """Rebuild offer_stats from scratch (the triggers keep it current afterwards)."""
+    cur = con.cursor()
+    cur.execute("DELETE FROM offer_stats")
+    cur.execute(f"INSERT INTO offer_stats ({OFFER_STATS_COLUMNS}) {OFFER_STATS_SELECT} GROUP BY product_id")
+    con.commit()
     cur.close()
 
 def main() -> None:
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     con = sqlite3.connect(DB_PATH)
     try:
+        # Only takes effect on a brand-new (empty) DB; WAL fixes it afterwards.
+        con.execute("PRAGMA page_size=4096;")
         con.execute("PRAGMA journal_mode=WAL;")
         con.execute("PRAGMA synchronous=NORMAL;")
+        if "--rebuild-indexes" in sys.argv:
+            create_bulk_indexes(con)
+            con.execute("ANALYZE")
+            con.commit()
+            print(f"Rebuilt bulk-load indexes at {os.path.abspath(DB_PATH)}")
+            return
         ensure_schema(con)
         print(f"Schema ensured at {os.path.abspath(DB_PATH)}")
+        if "--for-bulk-load" in sys.argv:
+            drop_bulk_indexes(con)
+            print("Dropped bulk-load indexes (run with --rebuild-indexes after loading)")
     finally:
         con.close()
 
@@ -18,9 +18,9 @@ from datetime import datetime
 DB_PATH = os.environ.get("DB_PATH") or os.path.join(os.path.dirname(__file__), "..", "data", "tooltally.db")
 DB_PATH = os.path.abspath(DB_PATH)
 
-def column_exists(cur, table, column):
+def get_columns(cur, table):
     cur.execute(f"PRAGMA table_info({table})")
-    return any(row[1].lower() == column.lower() for row in cur.fetchall())
+    return {row[1].lower() for row in cur.fetchall()}
 
 def index_exists(cur, name):
     cur.execute("PRAGMA index_list(products)")
@@ -46,9 +46,11 @@ def main():
             ("chuck", "TEXT"),
             ("ean_gtin", "TEXT"),
         ]
+        existing = get_columns(cur, "products")
         for name, typ in cols:
-            if not column_exists(cur, "products", name):
+            if name.lower() not in existing:
                 cur.execute(f"ALTER TABLE products ADD COLUMN {name} {typ};")
+                existing.add(name.lower())
 
         # Unique index on fingerprint (if present)
         if not index_exists(cur, "idx_products_fingerprint"):
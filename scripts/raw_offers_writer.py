@@ -1,7 +1,10 @@
 # scripts/raw_offers_writer.py
+import atexit
 import sqlite3
+import threading
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, Iterable, Any
 
 DB_PATH = Path(__file__).resolve().parents[1] / "data" / "tooltally.db"
 
@@ -38,17 +41,46 @@ ON CONFLICT(vendor, url) DO UPDATE SET
 """
 
 def _ensure_table(con: sqlite3.Connection) -> None:
+    # WAL + synchronous=NORMAL: no rollback journal and no fsync per commit
+    # (still crash-safe); a re-scrape rewrites the same rows anyway.
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-65536")
     con.executescript(CREATE_RAW_SQL)
 
-def save_many_raw_offers(rows: List[Dict[str, Any]]) -> int:
-    if not rows:
+# One connection per thread, opened (and schema-checked) on first use and
+# kept for the life of the process, so repeat saves skip the open/PRAGMA/DDL
+# work and keep SQLite's page cache warm.
+_local = threading.local()
+
+def _get_conn() -> sqlite3.Connection:
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH)
+        _ensure_table(con)
+        _local.con = con
+        atexit.register(con.close)
+    return con
+
+def save_many_raw_offers(rows: Iterable[Dict[str, Any]], chunk_size: int = 10_000) -> int:
+    # Rows go in chunk_size slices (one transaction overall), so a generator
+    # is never materialised in full and each executemany stays a sane size.
+    it = iter(rows)
+    chunk = list(islice(it, chunk_size))
+    if not chunk:
         return 0
-    con = sqlite3.connect(DB_PATH)
+    con = _get_conn()
+    saved = 0
     try:
-        _ensure_table(con)
-        con.executemany(UPSERT_SQL, rows)
+        con.execute("BEGIN IMMEDIATE")
+        while chunk:
+            con.executemany(UPSERT_SQL, chunk)
+            saved += len(chunk)
+            chunk = list(islice(it, chunk_size))
         con.commit()
-        # sqlite3 rowcount is unreliable for executemany; just report input length
-        return len(rows)
-    finally:
-        con.close()
+    except BaseException:
+        con.rollback()
+        raise
+    # sqlite3 rowcount is unreliable for executemany; just report input length
+    return saved
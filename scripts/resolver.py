@@ -25,7 +25,9 @@ from __future__ import annotations
 import sqlite3
 import re
 import hashlib
+import json
 from collections import defaultdict, Counter
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
 
 # ----------------------------
@@ -35,10 +37,14 @@ def set_pragmas(con: sqlite3.Connection) -> None:
     cur = con.cursor()
     cur.execute("PRAGMA foreign_keys = ON;")
     cur.execute("PRAGMA journal_mode = WAL;")
+    # Rerunnable ingest: NORMAL skips the per-commit fsync (WAL keeps the DB
+    # consistent; a power cut can only lose the last commits, which a rerun
+    # redoes), and a bigger cache/mmap cuts read syscalls.
     cur.execute("PRAGMA synchronous = NORMAL;")
     cur.execute("PRAGMA temp_store = MEMORY;")
+    cur.execute("PRAGMA cache_size = -65536;")
     try:
-        cur.execute("PRAGMA mmap_size = 30000000000;")
+        cur.execute("PRAGMA mmap_size = 268435456;")
     except Exception:
         pass
     cur.close()
@@ -47,6 +53,12 @@ def set_pragmas(con: sqlite3.Connection) -> None:
 # Normalisation & parsing
 # ----------------------------
 ALNUM_UPPER = re.compile(r'[^A-Z0-9]')
+NON_DIGIT = re.compile(r'\D')
+VOLT_RE = re.compile(r'(\d{2})(?:\.\d)?\s*v')
+BATT_PACK_RE = re.compile(r'\b[12]x\s*\d(?:\.\d)?\s*ah\b')
+WS_RE = re.compile(r'\s+')
+MAKITA_SUFFIX_RE = re.compile(r'(Z|J|TJ|RTJ|RJ|RFJ|RMJ|RTE?J|S?J)$')
+DEWALT_SUFFIX_RE = re.compile(r'(N|NT|P1|P2|PS)$')
 
 def norm_mpn(s: Optional[str]) -> Optional[str]:
     if not s:
@@ -57,13 +69,13 @@ def norm_mpn(s: Optional[str]) -> Optional[str]:
 def norm_ean(s: Optional[str]) -> Optional[str]:
     if not s:
         return None
-    digits = re.sub(r'\D', '', s)
+    digits = NON_DIGIT.sub('', s)
     return digits if len(digits) in (8, 12, 13, 14) else None
 
 def norm_voltage(title: str) -> Optional[str]:
     t = title.lower()
     t = t.replace('20v max', '18v').replace('10.8v', '12v')
-    m = re.search(r'(\d{2})(?:\.\d)?\s*v', t)
+    m = VOLT_RE.search(t)
     return f"{m.group(1)}v" if m else None
 
 def kit_signature(title: str, mpn: Optional[str]) -> str:
@@ -75,7 +87,7 @@ def kit_signature(title: str, mpn: Optional[str]) -> str:
     if any(k in t for k in ('makpac','tstak','case','carry case','inlay','box')) \
        and not any(k in t for k in ('battery','batteries','charger')):
         return 'case-only'
-    if re.search(r'\b[12]x\s*\d(?:\.\d)?\s*ah\b', t) or 'with battery' in t or 'with charger' in t or ' 1 x ' in t or ' 2 x ' in t:
+    if BATT_PACK_RE.search(t) or 'with battery' in t or 'with charger' in t or ' 1 x ' in t or ' 2 x ' in t:
         return '2-batt kit' if ('2x' in t or ' 2 x ' in t) else 'starter kit'
     return 'unknown'
 
@@ -102,16 +114,24 @@ def extract_brand_model_base(title: str) -> Tuple[Optional[str], Optional[str]]:
     for brand, patt in BRAND_PATTS:
         m = patt.search(title)
         if m:
-            code = re.sub(r'\s+', '', m.group(1).upper())
+            code = WS_RE.sub('', m.group(1).upper())
             base = code
             if brand == 'Makita':
-                base = re.sub(r'(Z|J|TJ|RTJ|RJ|RFJ|RMJ|RTE?J|S?J)$', '', base)
+                base = MAKITA_SUFFIX_RE.sub('', base)
             if brand == 'DeWalt':
-                base = re.sub(r'(N|NT|P1|P2|PS)$', '', base)
+                base = DEWALT_SUFFIX_RE.sub('', base)
             return brand, base
     head = (title.strip().split() or [''])[0].lower()
     return (HEAD_BRAND_MAP.get(head), None)
 
+# Vendors relist the same titles (and several vendors share one), so cache
+# the pure title parse: regex work scales with distinct titles, not rows.
+@lru_cache(maxsize=65536)
+def parse_title(title: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Brand, model base and voltage from a title; done once per row."""
+    brand, model_base = extract_brand_model_base(title)
+    return brand, model_base, norm_voltage(title)
+
 CATEGORY_MAP = {
     'drills': 'Drills',
     'combi drill': 'Drills',
@@ -147,17 +167,17 @@ def canon_category(s: Optional[str], fallback_title: Optional[str] = None) -> Op
 # ----------------------------
 def candidate_keys(row: Dict) -> List[Tuple[str, str]]:
     """
-    Emit keys for a raw_offers row:
+    Emit keys for a raw_offers row (brand/model_base/volt already parsed
+    from its title by parse_title):
       - ean:    EAN/GTIN digits
       - mpn:    Brand|MPN (normalized)
       - model:  Brand|ModelBase|Voltage|Kit (strict)
       - modelb: Brand|ModelBase (relaxed, no voltage/kit)
     """
     title = row.get('title') or ''
-    brand, model_base = extract_brand_model_base(title)
+    brand, model_base, volt = row['brand'], row['model_base'], row['volt']
     ean = norm_ean(row.get('ean_gtin'))
     mpn = norm_mpn(row.get('mpn'))
-    volt = norm_voltage(title)
     kit  = kit_signature(title, mpn)
 
     keys: List[Tuple[str,str]] = []
@@ -196,7 +216,7 @@ def choose_fingerprint(cluster_rows: List[Dict]) -> str:
     """Priority: ean > mpn > model > modelb; include one representative for transparency."""
     eans, mpns, models, modelbs = set(), set(), set(), set()
     for r in cluster_rows:
-        for typ, key in candidate_keys(r):
+        for typ, key in r['keys']:
             if   typ == 'ean':    eans.add(key)
             elif typ == 'mpn':    mpns.add(key)
             elif typ == 'model':  models.add(key)
@@ -241,25 +261,28 @@ def uniquify_fingerprint(base_fp: str, cluster_rows: List[Dict], used: set[str])
 # ----------------------------
 # DB helpers
 # ----------------------------
-def get_vendor_id(cur: sqlite3.Cursor, name: str) -> int:
-    cur.execute("SELECT id FROM vendors WHERE lower(name)=lower(?)", (name,))
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute("INSERT INTO vendors(name) VALUES(?)", (name,))
-    return cur.lastrowid
-
-def insert_offer(cur: sqlite3.Cursor,
-                 product_id: int,
-                 vendor_id: int,
-                 price_pounds: Optional[float],
-                 url: Optional[str],
-                 vendor_sku: Optional[str],
-                 scraped_at: Optional[str]) -> None:
-    cur.execute("""
+def load_vendor_ids(cur: sqlite3.Cursor) -> Dict[str, int]:
+    """Lower-cased vendor name → id; vendors are a handful of rows, so load them once."""
+    vendor_ids: Dict[str, int] = {}
+    for vid, name in cur.execute("SELECT id, name FROM vendors ORDER BY id"):
+        vendor_ids.setdefault(name.lower(), vid)
+    return vendor_ids
+
+def get_vendor_id(cur: sqlite3.Cursor, name: str, vendor_ids: Dict[str, int]) -> int:
+    key = name.lower()
+    vid = vendor_ids.get(key)
+    if vid is None:
+        cur.execute("INSERT INTO vendors(name) VALUES(?)", (name,))
+        vid = vendor_ids[key] = cur.lastrowid
+    return vid
+
+def insert_offers(cur: sqlite3.Cursor,
+                  offers: List[Tuple[int, int, Optional[float], Optional[str], Optional[str], Optional[str]]]) -> None:
+    """offers: (product_id, vendor_id, price_pounds, url, vendor_sku, scraped_at) tuples."""
+    cur.executemany("""
         INSERT INTO offers (product_id, vendor_id, price_pounds, url, vendor_sku, scraped_at, created_at)
         VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    """, (product_id, vendor_id, price_pounds, url, vendor_sku, scraped_at))
+    """, offers)
 
 def build_product_display_name(brand: Optional[str],
                                model: Optional[str],
@@ -290,10 +313,15 @@ def get_or_create_product(cur: sqlite3.Cursor,
         try: v_int = int(voltage[:-1])
         except ValueError: v_int = None
 
-    # 1) Fast path: try to insert (ignored if UNIQUE hits)
+    # 1) Fast path: insert and get the id back in one statement. Any UNIQUE
+    #    clash (fingerprint, name/category) inserts nothing and returns no row.
+    #    DO NOTHING rather than a no-op DO UPDATE: an UPDATE would fire the
+    #    products FTS triggers for every existing product.
     cur.execute("""
-        INSERT OR IGNORE INTO products (name, category, fingerprint, brand, model, power_source, voltage, kit, chuck, ean_gtin)
+        INSERT INTO products (name, category, fingerprint, brand, model, power_source, voltage, kit, chuck, ean_gtin)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        RETURNING id
     """, (
         name,
         category,
@@ -306,8 +334,10 @@ def get_or_create_product(cur: sqlite3.Cursor,
         None,
         ean_gtin or None,
     ))
+    row = cur.fetchone()
+    if row:
+        return row[0]
 
-    # If row inserted, fetch id by fingerprint or name
     cur.execute("SELECT id FROM products WHERE fingerprint = ?", (fingerprint,))
     row = cur.fetchone()
     if row:
@@ -379,7 +409,6 @@ def get_or_create_product(cur: sqlite3.Cursor,
 # ----------------------------
 def resolve(db_path: str = "data/tooltally.db", batch_commit_every: int = 500) -> None:
     con = sqlite3.connect(db_path)
-    con.row_factory = sqlite3.Row
     set_pragmas(con)
     cur = con.cursor()
 
@@ -389,33 +418,42 @@ def resolve(db_path: str = "data/tooltally.db", batch_commit_every: int = 500) -
         FROM raw_offers
         WHERE processed=0
     """)
-    raw = cur.fetchall()
-    if not raw:
-        print("No unprocessed raw_offers found. Nothing to do.")
-        con.close()
-        return
-
+    # Plain tuples in SELECT order (no sqlite3.Row per row), streamed off the
+    # cursor and unpacked straight into the working dict: no fetchall() copy
+    # of the whole backlog alongside it.
     rows: List[Dict] = []
-    for r in raw:
+    for (rid, vendor, title, price_pounds, url, vendor_sku,
+         category_name, scraped_at, ean_gtin, mpn) in cur:
+        title = title or ''
+        brand, model_base, volt = parse_title(title)
         rows.append({
-            'id': r['id'],
-            'vendor': r['vendor'],
-            'title': r['title'] or '',
-            'price_pounds': r['price_pounds'],
-            'url': r['url'],
-            'vendor_sku': r['vendor_sku'],
-            'category_name': r['category_name'],
-            'scraped_at': r['scraped_at'],
-            'ean_gtin': r['ean_gtin'],
-            'mpn': r['mpn'],
+            'id': rid,
+            'vendor': vendor,
+            'title': title,
+            'brand': brand,
+            'model_base': model_base,
+            'volt': volt,
+            'price_pounds': price_pounds,
+            'url': url,
+            'vendor_sku': vendor_sku,
+            'category_name': category_name,
+            'scraped_at': scraped_at,
+            'ean_gtin': ean_gtin,
+            'mpn': mpn,
         })
+    if not rows:
+        print("No unprocessed raw_offers found. Nothing to do.")
+        con.close()
+        return
 
     n = len(rows)
     dsu = DSU(n)
     key_index: Dict[str, List[int]] = defaultdict(list)
 
     for i, row in enumerate(rows):
-        for typ, key in candidate_keys(row):
+        # Kept on the row: choose_fingerprint needs the same keys per cluster
+        row['keys'] = candidate_keys(row)
+        for typ, key in row['keys']:
             key_index[f'{typ}:{key}'].append(i)
 
     for idxs in key_index.values():
@@ -432,6 +470,18 @@ def resolve(db_path: str = "data/tooltally.db", batch_commit_every: int = 500) -
     offer_count = 0
     processed_count = 0
     used_fingerprints: set[str] = set()
+    vendor_ids = load_vendor_ids(cur)
+    # Offer inserts and processed flags are queued: offers go out in one
+    # executemany, and the whole batch is marked processed by one UPDATE.
+    pending_offers: List[Tuple] = []
+    pending_processed: List[int] = []
+
+    def flush() -> None:
+        insert_offers(cur, pending_offers)
+        cur.execute("UPDATE raw_offers SET processed=1 WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(pending_processed),))
+        pending_offers.clear()
+        pending_processed.clear()
 
     try:
         cur.execute("BEGIN;")
@@ -441,10 +491,9 @@ def resolve(db_path: str = "data/tooltally.db", batch_commit_every: int = 500) -
 
             brands, models, volts, kits, eans, cats = [], [], [], [], [], []
             for rr in cluster_rows:
-                b, m = extract_brand_model_base(rr['title'])
-                brands.append(b)
-                models.append(m)
-                volts.append(norm_voltage(rr['title']))
+                brands.append(rr['brand'])
+                models.append(rr['model_base'])
+                volts.append(rr['volt'])
                 kits.append(kit_signature(rr['title'], rr.get('mpn')))
                 eans.append(norm_ean(rr.get('ean_gtin')))
                 cats.append(canon_category(rr.get('category_name'), rr['title']))
@@ -476,31 +525,23 @@ def resolve(db_path: str = "data/tooltally.db", batch_commit_every: int = 500) -
             )
             product_count += 1
 
-            # Offers
+            # Offers, then mark processed
             for rr in cluster_rows:
-                vendor_id = get_vendor_id(cur, rr['vendor'])
-                insert_offer(
-                    cur,
-                    product_id=prod_id,
-                    vendor_id=vendor_id,
-                    price_pounds=rr['price_pounds'],
-                    url=rr['url'],
-                    vendor_sku=rr['vendor_sku'],
-                    scraped_at=rr['scraped_at']
-                )
-                offer_count += 1
-
-            # Mark processed
-            cur.executemany(
-                "UPDATE raw_offers SET processed=1 WHERE id=?",
-                [(rr['id'],) for rr in cluster_rows]
-            )
+                vendor_id = get_vendor_id(cur, rr['vendor'], vendor_ids)
+                pending_offers.append((prod_id, vendor_id, rr['price_pounds'], rr['url'],
+                                       rr['vendor_sku'], rr['scraped_at']))
+                pending_processed.append(rr['id'])
+            offer_count += len(cluster_rows)
             processed_count += len(cluster_rows)
 
             if batch_commit_every and processed_count % batch_commit_every == 0:
+                flush()
                 con.commit()
                 cur.execute("BEGIN;")
+            elif len(pending_offers) >= 5000:
+                flush()
 
+        flush()
         con.commit()
     except Exception:
         con.rollback()
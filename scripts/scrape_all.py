@@ -18,8 +18,9 @@ def run(cmd: list[str]) -> None:
     subprocess.run(cmd, check=True)
 
 def main() -> None:
-    # Ensure schema exists
-    run([sys.executable, str(HERE / "migrate.py")])
+    # Ensure schema exists; raw_offers' secondary indexes are dropped for the
+    # load and built once at the end instead of updated per inserted row.
+    run([sys.executable, str(HERE / "migrate.py"), "--for-bulk-load"])
 
     runners = [
         "scrape_toolstation.py",
@@ -28,8 +29,11 @@ def main() -> None:
         "scrape_dandm.py",
         "scrape_ukplanettools.py",
     ]
-    for script in runners:
-        run([sys.executable, str(HERE / script)])
+    try:
+        for script in runners:
+            run([sys.executable, str(HERE / script)])
+    finally:
+        run([sys.executable, str(HERE / "migrate.py"), "--rebuild-indexes"])
 
     if "--no-resolve" not in sys.argv:
         run([sys.executable, str(HERE / "resolver.py")])
@@ -0,0 +1,86 @@
+"""fetch_identifiers must give the same (mpn, ean) as parsing the whole page.
+
+Run from the repo root (needs requests, lxml):  python -m unittest discover -s tests
+"""
+
+import threading
+import unittest
+from unittest import mock
+
+from scripts import enrich_identifiers_from_pages as enrich
+
+# Filler so every page spans several iter_content chunks (16 KB each)
+FILLER = "<p>" + "Lorem ipsum dolor sit amet. " * 1500 + "</p>"
+
+HEAD_SKU_ONLY = """<html><head><title>Makita DHP484Z</title>
+<script type="application/ld+json">{"@type": "Product", "sku": "UKPT-99812"}</script>
+</head><body>"""
+
+HEAD_MPN_ONLY = """<html><head><title>Makita DHP484Z</title>
+<script type="application/ld+json">{"@type": "Product", "mpn": "DHP484Z"}</script>
+</head><body>"""
+
+HEAD_BOTH = """<html><head><title>Makita DHP484Z</title>
+<script type="application/ld+json">{"@type": "Product", "mpn": "DHP484Z", "gtin13": "0088381868298"}</script>
+</head><body>"""
+
+SPEC_TABLE = """<table>
+<tr><th>Manufacturer Part Number</th><td>DHP484Z</td></tr>
+<tr><th>EAN</th><td>0088381868298</td></tr>
+</table>"""
+
+BODY_GTIN = """<script type="application/ld+json">{"@type": "Product", "gtin13": "0088381868298"}</script>"""
+
+
+class FakeResponse:
+    def __init__(self, html: str):
+        self._data = html.encode("utf-8")
+        self.headers = {"Content-Type": "text/html; charset=utf-8"}
+        self.encoding = "utf-8"
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self._data), chunk_size):
+            yield self._data[i:i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def fetch(url: str, html: str):
+    with mock.patch.object(enrich.SESSION, "get", return_value=FakeResponse(html)):
+        return enrich.fetch_identifiers(url, threading.Semaphore(1))
+
+
+class FetchIdentifiersTest(unittest.TestCase):
+    def assert_matches_full_page(self, url: str, html: str, expected):
+        extractor = enrich.HOST_EXTRACTORS.get(enrich.host_from_url(url))
+        self.assertEqual(enrich.extract_identifiers_from_html(html, extractor), expected)
+        self.assertEqual(fetch(url, html), expected)
+
+    def test_spec_table_outranks_head_json_ld(self):
+        # ukplanettools checks the spec table first: the head sku must not win
+        html = HEAD_SKU_ONLY + FILLER + SPEC_TABLE + "</body></html>"
+        self.assert_matches_full_page(
+            "https://www.ukplanettools.co.uk/p/1", html, ("DHP484Z", "0088381868298"))
+
+    def test_body_gtin_completes_head_mpn(self):
+        html = HEAD_MPN_ONLY + FILLER + BODY_GTIN + "</body></html>"
+        self.assert_matches_full_page(
+            "https://www.toolstation.com/p/1", html, ("DHP484Z", "0088381868298"))
+
+    def test_head_with_both_ids(self):
+        html = HEAD_BOTH + FILLER + SPEC_TABLE.replace("DHP484Z", "OTHER1") + "</body></html>"
+        self.assert_matches_full_page(
+            "https://www.screwfix.com/p/1", html, ("DHP484Z", "0088381868298"))
+
+    def test_generic_extractor(self):
+        html = HEAD_MPN_ONLY + FILLER + SPEC_TABLE + "</body></html>"
+        self.assert_matches_full_page(
+            "https://example.com/p/1", html, ("DHP484Z", "0088381868298"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -32,6 +32,9 @@ class SQLitePipeline:
                 UNIQUE(vendor_id, product_code)
             )
         """)
+        # The API lists products ordered by name and filters on it; with this
+        # index that's an in-order index walk rather than a scan plus sort.
+        self.cur.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)")
         # Commit table creation
         self.conn.commit()
 